@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import argparse
+import gzip
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import document_pb2
+from coders import codings
+
+# benchmark: synthetic corpus is indexed by index.py with every coding,
+# and query mixes are answered by search_server.Searcher (in this process) with every index.
+# corpus is gzipped stream of documents in the format of index.DocumentStreamReader:
+#   size; (4 bytes) size of serialized document
+#   document; (size bytes) document_pb2.document (url and text)
+# words of text are drawn from Zipf distribution over vocabulary (word of rank k
+# has probability proportional to 1 / k ** zipf_s), count of words of every document
+# is 1 + Poisson(doc_len). word of rank k is k written with cyrillic letters as digits
+# (so frequent words are short, and text is utf-8 as in real corpus).
+
+letters = u'абвгдежзийклмнопрстуфхцчшщъыьэюя'
+
+def rank_word(rank):
+    word = []
+    while True:
+        rank, digit = divmod(rank, len(letters))
+        word.append(letters[digit])
+        if not rank:
+            return u''.join(word)
+
+def write_corpus(path, n_docs, vocab_size, doc_len, zipf_s, rng):
+    """
+    write synthetic corpus of n_docs documents to file path (see above)
+    """
+    cdf = np.cumsum(1.0 / np.arange(1, vocab_size + 1) ** zipf_s)
+    cdf /= cdf[-1]
+    vocab = [rank_word(rank) for rank in xrange(vocab_size)]
+    with gzip.open(path, 'wb') as f:
+        for doc_n in xrange(n_docs):
+            ranks = np.searchsorted(cdf, rng.random_sample(1 + rng.poisson(doc_len)))
+            doc = document_pb2.document()
+            doc.url = u'https://lenta.ru/bench/{}/'.format(doc_n)
+            doc.text = u' '.join([vocab[rank] for rank in ranks])
+            msg = doc.SerializeToString()
+            f.write(struct.pack('i', len(msg)))
+            f.write(msg)
+
+def make_queries(n_queries, vocab_size, rng):
+    """
+    returns dict: name of query mix -> list of n_queries queries (utf-8 strings).
+    common words are of top 100 ranks, rare ones are of ranks from vocab_size / 10,
+    wildcards are prefixes of medium words (of top 2000 ranks)
+    """
+    common = lambda: rank_word(rng.randint(0, min(100, vocab_size)))
+    medium = lambda: rank_word(rng.randint(0, min(2000, vocab_size)))
+    rare = lambda: rank_word(rng.randint(vocab_size / 10, vocab_size))
+    mixes = {
+        'and': lambda: u'{} & {}'.format(common(), medium()),
+        'and_rare_common': lambda: u'{} & {} & {}'.format(rare(), common(), common()),
+        'or_rare': lambda: u'{} | {} | {}'.format(rare(), rare(), rare()),
+        'wildcard': lambda: u'{}* & {}'.format(medium()[:2], common()),
+        'boolean': lambda: [
+            u'({} | {}) & !{}'.format(medium(), medium(), common()),
+            u'{} & ({} | {}) & !({} | {})'.format(common(), medium(), rare(), medium(), medium()),
+            u'!{} & {} {}'.format(common(), medium(), medium()),
+        ][rng.randint(0, 3)],
+    }
+    return dict((name, [make().encode('utf-8') for k in xrange(n_queries)])
+                for name, make in mixes.items())
+
+def run_indexer(repo_dir, work_dir, corpus_path, coding, index_args):
+    """
+    index corpus by index.py in work_dir, returns (wall time in seconds, peak RSS in bytes)
+    """
+    start = time.time()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(repo_dir, 'index.py'), corpus_path, '--coding', coding] + index_args,
+        cwd=work_dir
+    )
+    pid, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.time() - start
+    if status != 0:
+        raise Exception('index.py failed with coding {}'.format(coding))
+    # ru_maxrss is in KB on Linux
+    return elapsed, usage.ru_maxrss * 1024
+
+def latency_stats(latencies):
+    """
+    returns dict with percentiles of latencies (in seconds) in ms
+    """
+    ms = np.array(latencies) * 1000.0
+    return {
+        'n': len(ms), 'mean_ms': ms.mean(), 'p50_ms': np.percentile(ms, 50),
+        'p90_ms': np.percentile(ms, 90), 'p99_ms': np.percentile(ms, 99), 'max_ms': ms.max(),
+    }
+
+def run_queries(work_dir, queries, stream, cache_size):
+    """
+    answer query mixes with index in work_dir, returns dict: name of mix -> latency_stats
+    """
+    from search_server import Searcher
+    searcher = Searcher(stream, os.path.join(work_dir, 'index'), os.path.join(work_dir, 'doc_ids'),
+                        cache_size=cache_size)
+    stats = {}
+    for name, mix in sorted(queries.items()):
+        latencies = []
+        for query in mix:
+            start = time.time()
+            searcher.answer(query)
+            latencies.append(time.time() - start)
+        stats[name] = latency_stats(latencies)
+    return stats
+
+def git_commit(repo_dir):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           cwd=repo_dir, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='benchmark of indexing and search '
+                                     'with synthetic Zipf corpus, results are written as json')
+    parser.add_argument('--docs', type=int, default=20000, dest='docs',
+                        help='count of documents of corpus (default: 20000)')
+    parser.add_argument('--vocab', type=int, default=100000, dest='vocab',
+                        help='size of vocabulary (default: 100000)')
+    parser.add_argument('--doc-len', type=int, default=200, dest='doc_len',
+                        help='mean count of words in document (default: 200)')
+    parser.add_argument('--zipf', type=float, default=1.1, dest='zipf',
+                        help='exponent of Zipf distribution of words (default: 1.1)')
+    parser.add_argument('--queries', type=int, default=200, dest='queries',
+                        help='count of queries of every query mix (default: 200)')
+    parser.add_argument('--seed', type=int, default=0, dest='seed',
+                        help='seed of random generator of corpus and queries (default: 0)')
+    parser.add_argument('--codings', type=str, nargs='+', default=codings[:-1],
+                        choices=codings[:-1], dest='codings',
+                        help='codings to benchmark (default: all)')
+    parser.add_argument('--index-args', type=str, default='', dest='index_args',
+                        help='more arguments of index.py (e.g. "-m 64 -r 0")')
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='evaluate queries with posting cursors (see search.py --stream)')
+    parser.add_argument('--cache-mb', type=int, default=0, dest='cache_mb',
+                        help='memory budget for caches of Searcher, MB (default: 0, no caches)')
+    parser.add_argument('--work-dir', type=str, default=None, dest='work_dir',
+                        help='directory for corpus and indexes (kept), temporary one by default')
+    parser.add_argument('-o', '--output', type=str, default='bench.json', dest='output',
+                        help='file to write results to (default: bench.json)')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_command_line()
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix='bench_'))
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    rng = np.random.RandomState(args.seed)
+    corpus_path = os.path.join(work_dir, 'corpus.gz')
+    write_corpus(corpus_path, args.docs, args.vocab, args.doc_len, args.zipf, rng)
+    queries = make_queries(args.queries, args.vocab, rng)
+    results = {
+        'commit': git_commit(repo_dir),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': vars(args),
+        'corpus_bytes': os.path.getsize(corpus_path),
+        'codings': {},
+    }
+    for coding in args.codings:
+        elapsed, peak_rss = run_indexer(repo_dir, work_dir, corpus_path, coding, args.index_args.split())
+        results['codings'][coding] = {
+            'index_s': elapsed,
+            'docs_per_s': args.docs / elapsed,
+            'index_peak_rss_mb': peak_rss / 2.0**20,
+            'index_bytes': os.path.getsize(os.path.join(work_dir, 'index')),
+            'doc_ids_bytes': os.path.getsize(os.path.join(work_dir, 'doc_ids')),
+            'queries': run_queries(work_dir, queries, args.stream, args.cache_mb * 2**20),
+        }
+        print('{}: {:.0f} docs/s'.format(coding, args.docs / elapsed), file=sys.stderr)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if args.work_dir is None:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+# estimated memory (in bytes) taken by cache entry besides its value (dict entry, key, links)
+entry_mem_size = 200
+
+class LRUCache:
+    """
+    least recently used cache with eviction by total size of values (in bytes).
+    hits and misses of get() are counted. cache may be shared by threads.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        returns value of key (None if key is not in cache), key becomes most recently used
+        """
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items[key] = item
+            return item[0]
+
+    def put(self, key, value, size):
+        """
+        put value of size bytes to cache, least recently used values are evicted
+        until all values fit in max_bytes (value is not put if it doesn't fit alone)
+        """
+        size += entry_mem_size
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.n_bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            while self.n_bytes + size > self.max_bytes:
+                self.n_bytes -= self.items.popitem(last=False)[1][1]
+            self.items[key] = (value, size)
+            self.n_bytes += size
+
+    def stats(self):
+        """
+        returns dict with counters of cache
+        """
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'items': len(self.items), 'bytes': self.n_bytes,
+        }
+
+def cache_array(cache, key, arr):
+    """
+    put np.array arr to cache (it is made read-only, because it is shared by users of cache)
+    """
+    arr.flags.writeable = False
+    cache.put(key, arr, arr.nbytes)
+
+class PrefixedCache:
+    """
+    view of cache where keys are prefixed by prefix (so several indexes may share one cache)
+    """
+
+    def __init__(self, cache, prefix):
+        self.cache = cache
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.cache.get((self.prefix, key))
+
+    def put(self, key, value, size):
+        self.cache.put((self.prefix, key), value, size)
+
+    def stats(self):
+        return self.cache.stats()
@@ -1,5 +1,14 @@
 from array import array as _array
-import numpy as _np
+from functools import partial as _partial
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+# codings of postlists, position in this list is codec id (stored in index header).
+# 'bitmap' is not a coding of numbers: dense postlists are stored as bitmaps of docIDs
+# (see postlist.BitmapPostlist), it can't be default coding of index
+codings = ['varbyte', 'simple9', 'pfordelta', 'bitmap']
 
 def vb_encode(n_list):
     """
@@ -43,6 +52,78 @@ def vb_append(arr, n):
         n = n >> 7
     arr.extend(code_l[::-1])
 
+def _as_np(arr, dtype):
+    """
+    view array obj (or buffer, or np.array) arr as np.array of given dtype without copying.
+    np.array of other dtype is reinterpreted as raw bytes, as well as any buffer.
+    """
+    if isinstance(arr, _np.ndarray):
+        return arr if arr.dtype == dtype else arr.view(dtype)
+    return _np.frombuffer(arr, dtype=dtype)
+
+def vb_sizes_np(n_arr):
+    """
+    n_arr is np.array of numbers.
+    returns np.array with sizes of varbyte codes of numbers (count of 7-bit groups)
+    """
+    n_bytes = _np.ones(len(n_arr), dtype='int64')
+    for k in xrange(1, 10):
+        n_bytes += n_arr >= (1 << (7 * k))
+    return n_bytes
+
+def vb_encode_np(n_list):
+    """
+    numpy version of vb_encode.
+    n_list is list or array obj or np.array of numbers to encode.
+    returns array obj with encoded numbers.
+    """
+    n_arr = _np.asarray(n_list, dtype='int64')
+    if not len(n_arr):
+        return _array('B')
+    n_bytes = vb_sizes_np(n_arr)
+    ends = _np.cumsum(n_bytes) - 1
+    code = _np.zeros(ends[-1] + 1, dtype='uint8')
+    # groups are written from the last (lowest) one to the first (highest) one
+    for k in xrange(int(n_bytes.max())):
+        has_group = n_bytes > k
+        code[ends[has_group] - k] = (n_arr[has_group] >> (7 * k)) & 127
+    code[ends] |= 128
+    return _array('B', code.tostring())
+
+def vb_decode_np(arr, cumulative=False):
+    """
+    numpy version of vb_decode.
+    arr is array obj (or buffer, or np.array) with encoded numbers.
+    returns np.array (int64) of decoded numbers.
+    cumulative: if True, returns cumsum of decoded numbers (postlist instead of deltas)
+    """
+    code = _as_np(arr, 'uint8')
+    ends = _np.flatnonzero(code & 128)
+    if not len(ends):
+        return _np.array([], dtype='int64')
+    code = code[:ends[-1] + 1]
+    starts = _np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # position of 7-bit group counting from the end of its number
+    group_n = _np.repeat(ends, ends - starts + 1) - _np.arange(len(code))
+    groups = (code & 127).astype('int64') << (7 * group_n)
+    n_arr = _np.bitwise_or.reduceat(groups, starts)
+    if cumulative:
+        return _np.cumsum(n_arr)
+    return n_arr
+
+def vb_encode_blocks(n_list, block_starts):
+    """
+    encode numbers from n_list in varbyte, all blocks at once (see pfd_encode_blocks).
+    returns (code, code_starts): np.array (uint8) with all encoded numbers,
+    np.array of positions of blocks in code (in bytes)
+    """
+    n_arr = _np.asarray(n_list, dtype='int64')
+    n_bytes = vb_sizes_np(n_arr)
+    code = _np.frombuffer(vb_encode_np(n_arr), dtype='uint8')
+    return code, (_np.cumsum(n_bytes) - n_bytes)[block_starts]
+
 s9_by_selector = {
     # selector: (size, count, waste)
     0: (1, 28, 0),
@@ -69,6 +150,11 @@ s9_by_size = {
     28: (8, 1, 0)
 }
 
+# count of numbers in word by selector (for vectorized decoding)
+_s9_counts = [s9_by_selector[sel][1] for sel in sorted(s9_by_selector)]
+if _np is not None:
+    _s9_counts = _np.array(_s9_counts)
+
 def s9_encode_word(n_list, start, selector, size, count, waste):
     """
     encode numbers from n_list[start:start+count] in s9 with given selector/size/count/waste.
@@ -107,6 +193,31 @@ def s9_decode(arr, remove_zeros=False):
         n_list += s9_decode_word(int(word), remove_zeros)
     return n_list
 
+def s9_decode_np(arr, remove_zeros=False):
+    """
+    numpy version of s9_decode.
+    words are grouped by selector (see s9_by_selector), and all numbers of each group
+    are extracted at once with shifts and masks.
+    arr is array obj (or buffer, or np.array) with s9-encoded numbers.
+    returns np.array (int64) of decoded numbers.
+    remove_zeros: if True, not adding decoded zeros to result
+    """
+    words = _as_np(arr, 'uint32').astype('int64')
+    selectors = words >> 28
+    counts = _s9_counts[selectors]
+    starts = _np.cumsum(counts) - counts
+    n_arr = _np.empty(counts.sum(), dtype='int64')
+    for selector in _np.unique(selectors):
+        size, count, waste = s9_by_selector[selector]
+        group = selectors == selector
+        # first number is in the highest bits of word
+        shifts = size * _np.arange(count - 1, -1, -1)
+        numbers = (words[group][:, None] >> shifts) & ((1 << size) - 1)
+        n_arr[starts[group][:, None] + _np.arange(count)] = numbers
+    if remove_zeros:
+        return n_arr[n_arr != 0]
+    return n_arr
+
 def s9_append(arr, buf, force_clear=False):
     """
     encode as much numbers from array obj buf as possible and append them to array obj arr.
@@ -152,3 +263,147 @@ def s9_append(arr, buf, force_clear=False):
                 read_ = buf_start
             arr.extend(words)
             return read_
+
+def s9_encode_blocks(n_list, block_starts):
+    """
+    encode numbers from n_list in simple9, block by block (see pfd_encode_blocks),
+    every block is finished with force_clear.
+    returns (code, code_starts): np.array (uint32) with all encoded blocks,
+    np.array of positions of blocks in code (in 4-byte words)
+    """
+    n_arr = _np.asarray(n_list, dtype='uint32')
+    arr = _array('I')
+    code_starts = _np.empty(len(block_starts), dtype='int64')
+    for k, (start, end) in enumerate(zip(block_starts, _np.append(block_starts[1:], len(n_arr)))):
+        code_starts[k] = len(arr)
+        s9_append(arr, _array('I', n_arr[start:end].tostring()), force_clear=True)
+    return _np.frombuffer(arr, dtype='uint32'), code_starts
+
+# PForDelta:
+#   numbers are split into blocks of pfd_block_size numbers (last block may be shorter).
+#   every block is encoded with one bit width b, chosen to minimize size of block,
+#   numbers which don't fit into b bits are patched with exceptions.
+# block: (everything is in 4-byte words)
+#   header; (count | b << 8 | n_exceptions << 16)
+#   packed; (ceil(count * b / 32) words, low b bits of every number, lowest bits first)
+#   exception_positions; (ceil(n_exceptions / 4) words, one byte for position)
+#   exception_highs; (n_exceptions words, (number >> b) for every exception)
+
+pfd_block_size = 128
+
+# (word_n, offset) of every number of a full block inside packed words, by bit width
+if _np is not None:
+    _pfd_unpack_pos = [
+        ((_np.arange(pfd_block_size) * b) >> 5, ((_np.arange(pfd_block_size) * b) & 31).astype('uint64'))
+        for b in xrange(33)
+    ]
+
+def pfd_encode_blocks(n_list, block_starts):
+    """
+    encode numbers from n_list in PForDelta blocks, all blocks at once.
+    block_starts is np.array of positions where blocks start in n_list
+    (every block must have at most pfd_block_size numbers).
+    returns (code, code_starts): np.array (uint32) with all encoded blocks,
+    np.array of positions of blocks in code (in 4-byte words)
+    """
+    n_arr = _np.asarray(n_list, dtype='uint64')
+    n_blocks = len(block_starts)
+    counts = _np.diff(_np.append(block_starts, len(n_arr)))
+    block_ns = _np.repeat(_np.arange(n_blocks), counts)
+    # exceptions count of every block for every bit width
+    bit_lens = _np.frexp(n_arr.astype('float64'))[1]
+    hist = _np.bincount(block_ns * 34 + bit_lens, minlength=n_blocks * 34).reshape(n_blocks, 34)
+    n_excs = counts[:, None] - _np.cumsum(hist, axis=1)[:, :33]
+    sizes = (counts[:, None] * _np.arange(33) + 31) // 32 + (n_excs + 3) // 4 + n_excs
+    bs = sizes.argmin(axis=1)
+    n_excs = n_excs[_np.arange(n_blocks), bs]
+    packed_starts = _np.cumsum(sizes[_np.arange(n_blocks), bs] + 1) - sizes[_np.arange(n_blocks), bs]
+    code_len = packed_starts[-1] + sizes[-1, bs[-1]] if n_blocks else 0
+    # packing low bits (bits of different numbers don't intersect, so sum is the same as or)
+    n_bits = bs[block_ns]
+    bit_pos = (_np.arange(len(n_arr)) - _np.repeat(block_starts, counts)) * n_bits
+    word_n = _np.repeat(packed_starts, counts) + (bit_pos >> 5)
+    n_bits = n_bits.astype('uint64')
+    low = n_arr & ((_np.uint64(1) << n_bits) - _np.uint64(1))
+    shifted = low << (bit_pos & 31).astype('uint64')
+    code = _np.bincount(word_n, weights=shifted & _np.uint64(0xffffffff), minlength=code_len + 2)
+    code += _np.bincount(word_n + 1, weights=shifted >> _np.uint64(32), minlength=code_len + 2)
+    code = code[:code_len].astype('uint32')
+    code[packed_starts - 1] = counts | (bs << 8) | (n_excs << 16)
+    # exceptions
+    exc_idx = _np.flatnonzero(n_arr >> n_bits)
+    exc_blocks = block_ns[exc_idx]
+    exc_rank = _np.arange(len(exc_idx)) - _np.repeat(_np.cumsum(n_excs) - n_excs, n_excs)
+    exc_starts = packed_starts + (counts * bs + 31) // 32
+    code.view('uint8')[exc_starts[exc_blocks] * 4 + exc_rank] = exc_idx - block_starts[exc_blocks]
+    highs_starts = exc_starts + (n_excs + 3) // 4
+    code[highs_starts[exc_blocks] + exc_rank] = n_arr[exc_idx] >> n_bits[exc_idx]
+    return code, packed_starts - 1
+
+def pfd_decode(arr):
+    """
+    decode numbers from array obj (or buffer, or np.array) with PForDelta-encoded numbers.
+    blocks are grouped by bit width, and all blocks of each group are unpacked at once
+    (only block headers are read one by one).
+    returns np.array (int64) of decoded numbers.
+    """
+    words = _as_np(arr, 'uint32')
+    headers = []
+    pos = 0
+    while pos < len(words):
+        header = int(words[pos])
+        count = header & 255
+        b = (header >> 8) & 63
+        n_exc = header >> 16
+        headers.append((pos, b, n_exc, count))
+        pos += 1 + (count * b + 31) // 32 + (n_exc + 3) // 4 + n_exc
+    if not headers:
+        return _np.array([], dtype='int64')
+    starts, bs, n_excs, counts = _np.array(headers).T
+    # reading beyond the last block is harmless: excess numbers are dropped
+    words64 = _np.append(words, _np.zeros(pfd_block_size + 1, dtype='uint32')).astype('uint64')
+    blocks = _np.zeros((len(headers), pfd_block_size), dtype='uint64')
+    for b in _np.unique(bs):
+        if not b:
+            continue
+        group = bs == b
+        word_n, offset = _pfd_unpack_pos[b]
+        packed_starts = starts[group][:, None] + 1
+        two_words = words64[packed_starts + word_n] \
+            | (words64[packed_starts + word_n + 1] << _np.uint64(32))
+        blocks[group] = (two_words >> offset) & _np.uint64((1 << int(b)) - 1)
+    blocks = blocks.astype('int64')
+    # patching exceptions
+    if n_excs.any():
+        exc_idx = _np.arange(n_excs.sum()) - _np.repeat(_np.cumsum(n_excs) - n_excs, n_excs)
+        exc_starts = starts + 1 + (counts * bs + 31) // 32
+        positions = words.view('uint8')[_np.repeat(exc_starts * 4, n_excs) + exc_idx]
+        highs_starts = exc_starts + (n_excs + 3) // 4
+        highs = words[_np.repeat(highs_starts, n_excs) + exc_idx].astype('int64')
+        block_n = _np.repeat(_np.arange(len(headers)), n_excs)
+        blocks[block_n, positions] |= highs << _np.repeat(bs, n_excs)
+    if (counts[:-1] == pfd_block_size).all():
+        return blocks.ravel()[:counts.sum()]
+    return blocks[_np.arange(pfd_block_size) < counts[:, None]]
+
+# for every coding: type of array obj with encoded numbers
+arr_types = {
+    'varbyte': 'B',
+    'simple9': 'I',
+    'pfordelta': 'I'
+}
+
+# for every coding: func(n_list, block_starts) -> (code, code_starts)
+#     to encode numbers from n_list split into blocks at once (see pfd_encode_blocks)
+block_encoders = {
+    'varbyte': vb_encode_blocks,
+    'simple9': s9_encode_blocks,
+    'pfordelta': pfd_encode_blocks
+}
+
+# for every coding: func(array obj or buffer or np.array) -> np.array of decoded numbers
+decoders = {
+    'varbyte': vb_decode_np,
+    'simple9': _partial(s9_decode_np, remove_zeros=True),
+    'pfordelta': pfd_decode
+}
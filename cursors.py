@@ -0,0 +1,155 @@
+import heapq
+import numpy as np
+from bisect import bisect_left
+from postlist import Postlist
+
+# docid of cursor which has reached its end
+END = float('inf')
+
+class PostlistCursor:
+    """
+    cursor over postlist (postlist.Postlist or np.array of docIDs).
+    Postlist is decoded block by block, only when cursor reaches the block.
+    """
+
+    def __init__(self, postlist):
+        self.postlist = postlist
+        if isinstance(postlist, Postlist) and len(postlist.firsts):
+            self.n_blocks = len(postlist.firsts)
+        else:
+            self.n_blocks = 1
+        self._load_block(0)
+
+    def _load_block(self, block_n):
+        self.block_n = block_n
+        if block_n >= self.n_blocks:
+            self.block = []
+        elif self.n_blocks > 1:
+            self.block = self.postlist.decode_block(block_n).tolist()
+        elif isinstance(self.postlist, Postlist):
+            self.block = self.postlist.decode().tolist()
+        else:
+            self.block = list(self.postlist)
+        self.pos = 0
+        self.docid = self.block[0] if self.block else END
+
+    def next(self):
+        self.pos += 1
+        if self.pos < len(self.block):
+            self.docid = self.block[self.pos]
+        else:
+            self._load_block(self.block_n + 1)
+
+    def next_geq(self, target):
+        """
+        move cursor to first docID >= target
+        """
+        while self.docid < target:
+            if self.block[-1] < target:
+                block_n = self.block_n + 1
+                if self.n_blocks > 1 and target != END:
+                    # skipping blocks which have only smaller docIDs
+                    block_n = max(block_n,
+                        np.searchsorted(self.postlist.firsts, target, side='right') - 1)
+                self._load_block(block_n)
+            else:
+                self.pos = bisect_left(self.block, target, self.pos)
+                self.docid = self.block[self.pos]
+
+class AndCursor:
+    """
+    cursor over intersection of cursors
+    """
+
+    def __init__(self, cursors):
+        self.cursors = cursors
+        self._align(max(cursor.docid for cursor in cursors))
+
+    def _align(self, target):
+        while target != END:
+            for cursor in self.cursors:
+                cursor.next_geq(target)
+                if cursor.docid > target:
+                    target = cursor.docid
+                    break
+            else:
+                break
+        self.docid = target
+
+    def next(self):
+        self.cursors[0].next()
+        self._align(self.cursors[0].docid)
+
+    def next_geq(self, target):
+        self.cursors[0].next_geq(target)
+        self._align(self.cursors[0].docid)
+
+class OrCursor:
+    """
+    cursor over union of cursors (merged with heap)
+    """
+
+    def __init__(self, cursors):
+        self.cursors = cursors
+        self.heap = [(cursor.docid, k) for k, cursor in enumerate(cursors) if cursor.docid != END]
+        heapq.heapify(self.heap)
+        self._update()
+
+    def _update(self):
+        self.docid = self.heap[0][0] if self.heap else END
+
+    def _advance(self, target, move):
+        # move every cursor which is behind target and put it back to heap
+        while self.heap and self.heap[0][0] < target:
+            k = heapq.heappop(self.heap)[1]
+            cursor = self.cursors[k]
+            move(cursor)
+            if cursor.docid != END:
+                heapq.heappush(self.heap, (cursor.docid, k))
+        self._update()
+
+    def next(self):
+        self._advance(self.docid + 1, lambda cursor: cursor.next())
+
+    def next_geq(self, target):
+        self._advance(target, lambda cursor: cursor.next_geq(target))
+
+class AndNotCursor:
+    """
+    cursor over docIDs of cursor which are not in excluded cursor
+    """
+
+    def __init__(self, cursor, excluded):
+        self.cursor = cursor
+        self.excluded = excluded
+        self._skip_excluded()
+
+    def _skip_excluded(self):
+        while self.cursor.docid != END:
+            self.excluded.next_geq(self.cursor.docid)
+            if self.excluded.docid != self.cursor.docid:
+                break
+            self.cursor.next()
+        self.docid = self.cursor.docid
+
+    def next(self):
+        self.cursor.next()
+        self._skip_excluded()
+
+    def next_geq(self, target):
+        self.cursor.next_geq(target)
+        self._skip_excluded()
+
+def and_cursor(cursors):
+    return cursors[0] if len(cursors) == 1 else AndCursor(cursors)
+
+def or_cursor(cursors):
+    return cursors[0] if len(cursors) == 1 else OrCursor(cursors)
+
+def iter_cursor(cursor):
+    """
+    generates all docIDs of cursor in ascending order
+    """
+    while cursor.docid != END:
+        yield cursor.docid
+        cursor.next()
@@ -1,8 +1,46 @@
 import re
+import mmh3
 
 SPLIT_RGX = re.compile(r'\w+', re.U)
 
+# max count of words in cache of hashes (cache is cleared when it is full)
+hash_cache_size = 2**18
+_hash_cache = {}
+
 
 def extract_words(text):
     words = re.findall(SPLIT_RGX, text)
     return map(lambda s: s.lower(), words)
+
+
+def extract_word_set_count(text):
+    """
+    returns (set of distinct words of text (the same words as extract_words),
+    count of all words of text), text is lowercased at once
+    (lowercasing doesn't change what r'\w+' matches)
+    """
+    words = SPLIT_RGX.findall(text.lower())
+    return set(words), len(words)
+
+
+def mmh3_hash(s):
+    """
+    64-bit hash
+    """
+    return mmh3.hash64(s)[0]
+
+
+def word_hashes(words):
+    """
+    words is iterable of unicode words
+    generates mmh3_hash of utf-8 encoding of every word,
+    hashes of words are memoized (word frequencies are Zipfian, so most words are in cache)
+    """
+    cache = _hash_cache
+    for word in words:
+        mm_hash = cache.get(word)
+        if mm_hash is None:
+            if len(cache) >= hash_cache_size:
+                cache.clear()
+            mm_hash = cache[word] = mmh3.hash64(word.encode('utf-8'))[0]
+        yield mm_hash
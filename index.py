@@ -6,18 +6,24 @@ import struct
 import gzip
 import sys
 
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool, Process, Queue
+from Queue import Empty
+
 import doc2words
-import mmh3
 from collections import defaultdict
+from itertools import izip
 from array import array
 from coders import *
+import numpy as np
+from postlist import encode_postlists_hybrid
+from index_writer import IndexWriter, merge_indexes, write_lexicon
+from index_reader import lexicon_path
+from profiling import ProfileWriter, stage, count, record_size, profiled_call, add_profile
 # from datetime import datetime
 
-# buffer will be passed to simple9 encoder only if len(buffer) is in buf_len_thres.
-# choosing of this parameter will reduce count of size-measurings of the same number
-# (because there may be not enough numbers to encode into 4-byte word with simple9)
-buf_len_thres = {14*6}
-
 class DocumentStreamReader:
     def __init__(self, paths):
         self.paths = paths
@@ -40,166 +46,496 @@ class DocumentStreamReader:
                     yield doc
 
 
+def read_batches(paths, batch_size):
+    """
+    generates lists of (url, text) of at most batch_size documents from files paths
+    """
+    batch = []
+    for doc in DocumentStreamReader(paths):
+        batch.append((doc.url, doc.text))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def produce_batches(paths, batch_size, queue):
+    """
+    put batches of documents from files paths to queue (None after every file),
+    exception is put to queue if reading fails
+    """
+    try:
+        for path in paths:
+            for batch in read_batches([path], batch_size):
+                queue.put(batch)
+            queue.put(None)
+    except Exception as e:
+        queue.put(e)
+
+class PipelinedDocumentReader:
+    """
+    reader of (url, text) of documents from files paths, files are decompressed
+    and parsed by n_producers processes (file i is read by producer i % n_producers),
+    so indexing is not waiting for gzip and protobuf.
+    every producer sends batches of documents over its own bounded queue
+    (at most queue_size batches), documents are generated in the same order as in paths.
+    if producer is terminated without sending its exception (killed, out of memory),
+    it is detected in at most poll_timeout seconds
+    """
+
+    poll_timeout = 1
+
+    def __init__(self, paths, n_producers=1, batch_size=256, queue_size=16):
+        self.paths = paths
+        self.n_producers = min(n_producers, len(paths))
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def __iter__(self):
+        queues = []
+        producers = []
+        for k in xrange(self.n_producers):
+            queue = Queue(self.queue_size)
+            producer = Process(target=produce_batches,
+                               args=(self.paths[k::self.n_producers], self.batch_size, queue))
+            producer.daemon = True
+            producer.start()
+            # queue is written only by its producer (other producers are started later),
+            # so if producer is terminated in the middle of batch,
+            # reading of batch fails instead of waiting for the rest of it
+            queue._writer.close()
+            queues.append(queue)
+            producers.append(producer)
+        try:
+            for path_n in xrange(len(self.paths)):
+                k = path_n % self.n_producers
+                while True:
+                    batch = self._get_batch(queues[k], producers[k])
+                    if batch is None:
+                        break
+                    if isinstance(batch, Exception):
+                        raise batch
+                    for url, text in batch:
+                        yield url, text
+            for producer in producers:
+                producer.join()
+        finally:
+            for producer in producers:
+                if producer.is_alive():
+                    producer.terminate()
+
+    def _get_batch(self, queue, producer):
+        """
+        returns next batch (or None or exception) from queue of producer
+        """
+        while True:
+            # batches put before producer exited are already in queue
+            alive = producer.is_alive()
+            try:
+                return queue.get(timeout=self.poll_timeout)
+            except Empty:
+                if alive:
+                    continue
+            except (EOFError, IOError):
+                # producer is terminated in the middle of batch
+                pass
+            producer.join()
+            raise Exception('reader of documents is terminated (exit code {})'
+                            .format(producer.exitcode))
+
+def read_documents(paths, n_readers):
+    """
+    returns iterator over (url, text) of documents from files paths,
+    files are read by n_readers processes (see PipelinedDocumentReader)
+    or in this process if n_readers is 0
+    """
+    if n_readers > 0:
+        return PipelinedDocumentReader(paths, n_readers)
+    return ((doc.url, doc.text) for doc in DocumentStreamReader(paths))
+
 def parse_command_line():
     parser = argparse.ArgumentParser(description='compressed documents reader')
     parser.add_argument('files', nargs='+', help='Input files (.gz or plain) to process')
     parser.add_argument('-c', '--coding', type=str,
-                        action='store', dest='coding', choices=['varbyte', 'simple9'],
-                        help='Coding method (varbyte | simple9)')
+                        action='store', dest='coding', choices=codings[:-1],
+                        help='Coding method (varbyte | simple9 | pfordelta), '
+                             'dense postlists are stored as bitmaps anyway')
+    parser.add_argument('-m', '--memory-limit', type=int, default=1024,
+                        action='store', dest='memory_limit',
+                        help='Memory budget for in-memory index, MB (default: 1024). '
+                             'When it is reached, index is flushed to temporary run file, '
+                             'runs are merged in the end')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        action='store', dest='jobs',
+                        help='Count of processes indexing input files in parallel '
+                             '(files are split into contiguous parts, default: 1)')
+    parser.add_argument('-r', '--readers', type=int, default=1,
+                        action='store', dest='readers',
+                        help='Count of processes decompressing and parsing input files '
+                             'while documents are indexed (0: read in indexing process, '
+                             'default: 1). Not used with --jobs > 1')
+    parser.add_argument('--append', type=str, default=None,
+                        action='store', dest='append',
+                        help='Add documents to segmented index in this directory '
+                             '(created if needed) as new segment, docIDs continue from '
+                             'the last segment (instead of writing index and doc_ids). '
+                             'Small segments are merged in background (see segments.py)')
+    parser.add_argument('--profile', type=str, default=None,
+                        action='store', dest='profile',
+                        help='write counters of indexing (docs/s, tokens/s, postings/s, '
+                             'time of flushes and merging) as json line to this file (- for stderr), '
+                             'see profiling.py')
+    parser.add_argument('--shards', type=str, default=None,
+                        action='store', dest='shards',
+                        help='Write index to this directory as shards by docID range '
+                             '(segmented index with one segment per part of files, see --jobs), '
+                             'shards are indexed in parallel and searched in parallel '
+                             'with search.py --segments DIR --workers')
     return parser.parse_args()
 
-def arr_size_count(arr):
-    return arr.buffer_info()[1] * arr.itemsize
+# index file:
+#   (everything in file is aligned by 4-byte words, even varbyte codes)
+#
+#   codec_id; (4 bytes, default post_list compression type, position in coders.codings
+#       (0: varbyte, 1: simple9, 2: pfordelta))
+#   num_terms; (4 bytes)
+#   dictionary: (parallel arrays, sorted by hash, term is found by binary search)
+#     hashes; (num_terms * 8 bytes)
+#     offsets; (num_terms * 8 bytes) offset of postlist record from beginning of file
+#     n_postings; (num_terms * 4 bytes)
+#     n_blocks; (num_terms * 4 bytes) 0 if post_list is one block (then there is no skip table)
+#     post_list_sizes; (num_terms * 4 bytes) NOTE: this is the size of encoding.
+#                                  actual size in file =
+#                                  aligned(this) = (this)+(-this)%4
+#     codec_ids; (num_terms * 1 byte) compression type of every post_list (3: bitmap)
+#   (padding to 8 bytes)
+#   {postlist_record_1}; ... ; {postlist_record_N};
+#       (index.py writes them in any order, make_dict.py rewrites them
+#       in the same order as dictionary, with the best coding for every post_list)
+# postlist_record_i:
+#   skip_firsts; (n_blocks * 4 bytes) first doc_id of every block
+#   skip_starts; (n_blocks * 4 bytes) count of postings before every block
+#   skip_offsets; (n_blocks * 4 bytes) offset of every block in post_list (in bytes)
+#   post_list; (aligned(post_list_size))
+# post_list is encoded deltas of doc_ids, split into blocks of skip_block_size postings.
+# every block is encoded separately (so it can be decoded without previous blocks),
+# first delta of block is not used in decoding: block starts with doc_id from skip table.
+# dense post_list (see postlist.is_dense) is bitmap instead (codec_id 3, one block):
+#   base; (4 bytes) doc_id of the lowest bit of bitmap (multiple of 32)
+#   words; (4 bytes each) bit k (from the lowest bit of the first word) is set
+#       if doc_id base + k is in post_list
+
+# docs file:
+# num_docs; (4 bytes)
+# block_size; (4 bytes) count of urls in every block (but the last one)
+# block_offsets; ((num_blocks + 1) * 8 bytes) offsets of blocks from beginning of file,
+#     last one is size of file (doc_id is in block (doc_id - 1) / block_size)
+# {block_1}; ...; {block_M}
+# block_i: front-coded urls of block_size documents in order of doc_ids
+#   url_1_prefix_size; (2 bytes) size of prefix shared with previous url of block (0 for first url)
+#   url_1_suffix_size; (4 bytes)
+#   url_1_suffix; (url_1_suffix_size)
+#   ...
+
+# lexicon file (near index file, see index_reader.lexicon_path):
+# num_terms; (4 bytes)
+# block_size; (4 bytes) count of terms in every block (but the last one)
+# block_offsets; ((num_blocks + 1) * 8 bytes) offsets of blocks from beginning of file,
+#     last one is size of file
+# {block_1}; ...; {block_M}
+# block_i: front-coded terms (utf-8) of block_size terms, terms are sorted (as byte strings)
+#   term_1_prefix_size; (2 bytes) size of prefix shared with previous term of block (0 for first term)
+#   term_1_suffix_size; (4 bytes)
+#   term_1_n; (4 bytes) position of term in dictionary of index
+#   term_1_suffix; (term_1_suffix_size)
+#   ...
+# block is found by binary search by first terms (they are not front-coded),
+# terms starting with prefix are one after another (see IndexReader.expand_prefix)
 
-def mmh3_hash(s):
+# in-memory index is columnar: terms get dense ids (term_keys: hash -> (id << 32),
+# term_hashes: id -> hash, term_words: id -> word for lexicon), and every posting is one 8-byte key (term id << 32) | doc_id
+# in one postings buffer. postlists are made on flush: keys are sorted in place
+# (so postings are grouped by term, with ascending doc_ids) and encoded chunk by chunk.
+# estimated memory (in bytes) taken by new term (dict entry with key and value, hash in array,
+#   word in list) and by one more posting
+term_mem_size = 180
+posting_mem_size = 8
+# count of postings decoded from keys and encoded at once on flush
+flush_chunk_size = 2**16
+
+def write_index(term_hashes, term_words, postings, path, coding):
     """
-    64-bit hash
+    sort postings of in-memory index (see above) by terms, encode postlists
+    and write index to file path (and its lexicon). postings (array obj of keys) is sorted in place.
     """
-    return mmh3.hash64(s)[0]
+    n_terms = len(term_hashes)
+    keys = np.frombuffer(postings, dtype='uint64')
+    keys.sort()
+    term_ends = np.searchsorted(keys, np.arange(1, n_terms + 1, dtype='uint64') << np.uint64(32))
+    term_starts = np.append([0], term_ends[:-1])
+    writer = IndexWriter(path, coding, n_terms)
+    term_n = 0
+    while term_n < n_terms:
+        start = term_starts[term_n]
+        # chunk is whole postlists with about flush_chunk_size postings (at least one postlist)
+        end_term_n = max(term_n + 1, np.searchsorted(term_ends, start + flush_chunk_size, side='right'))
+        docids = (keys[start:term_ends[end_term_n - 1]] & np.uint64(0xffffffff)).astype('int64')
+        postlists = encode_postlists_hybrid(docids, term_starts[term_n:end_term_n] - start, coding)
+        for mm_hash, (n_postings, skips, arr, pl_coding) in zip(term_hashes[term_n:end_term_n], postlists):
+            writer.add(mm_hash, n_postings, skips, arr, pl_coding)
+        term_n = end_term_n
+    writer.close()
+    # position of term in dictionary is rank of its hash
+    term_ns = np.empty(n_terms, dtype='int64')
+    term_ns[np.argsort(np.frombuffer(term_hashes, dtype='int64'))] = np.arange(n_terms)
+    write_lexicon(sorted(zip([word.encode('utf-8') for word in term_words], term_ns.tolist())),
+                  lexicon_path(path))
 
-if __name__ == '__main__':
+def flush_run(term_hashes, term_words, postings, path, coding):
+    """
+    write_index() profiled as flush
+    """
+    with stage('flush'):
+        write_index(term_hashes, term_words, postings, path, coding)
+    count('flushes')
+    record_size('flush', len(postings))
+
+def build_index(paths, coding, mem_limit, index_path, n_readers=0):
+    """
+    index documents from files paths (doc_ids start from 1) and write index to file index_path.
+    files are read by n_readers processes (see read_documents).
+    mem_limit is memory budget for in-memory index (in bytes):
+    single-pass in-memory indexing, in-memory index is flushed to sorted run
+    when its estimated size reaches mem_limit, runs are merged in the end.
+    returns list of urls of documents.
+    """
     # t1 = datetime.now()
-    index = {}
     docs = []
-    reader = DocumentStreamReader(parse_command_line().files)
-    coding = parse_command_line().coding
+    reader = read_documents(paths, n_readers)
+    runs_dir = None
+    runs = []
+    doc_id = 1
+    term_keys = {}
+    term_hashes = array('l')
+    term_words = []
+    postings = array('L')
+    n_postings = 0
+    n_tokens = 0
+    # runs are removed even if indexing fails
+    try:
+        for url, text in reader:
+            # print("{:<7} ({:>6} B): {}".format(doc_id, len(text), url))
+            docs.append(url.encode('utf-8'))
+            doc_terms = set()
+            words, n_words = doc2words.extract_word_set_count(text)
+            n_tokens += n_words
+            # set is iterated in the same order by word_hashes
+            for word, mm_hash in izip(words, doc2words.word_hashes(words)):
+                term_key = term_keys.get(mm_hash)
+                if term_key is None:
+                    term_key = term_keys[mm_hash] = len(term_hashes) << 32
+                    term_hashes.append(mm_hash)
+                    term_words.append(word)
+                doc_terms.add(term_key)
+            postings.extend([term_key | doc_id for term_key in doc_terms])
+            n_postings += len(doc_terms)
+            doc_id += 1
+            if len(term_hashes) * term_mem_size + len(postings) * posting_mem_size >= mem_limit:
+                if runs_dir is None:
+                    runs_dir = tempfile.mkdtemp(prefix='index_runs_', dir='.')
+                runs.append(os.path.join(runs_dir, 'run_{}'.format(len(runs))))
+                # terms of next run get new ids, the table is not needed for flush
+                term_keys = {}
+                flush_run(term_hashes, term_words, postings, runs[-1], coding)
+                term_hashes = array('l')
+                term_words = []
+                postings = array('L')
+        # t2 = datetime.now()
+        # time_elapsed = (t2 - t1).total_seconds()
+        # print("indexing done in {} s (except encoding)".format(time_elapsed))
+        del term_keys
+        count('docs', doc_id - 1)
+        count('tokens', n_tokens)
+        count('postings', n_postings)
+        if not runs:
+            flush_run(term_hashes, term_words, postings, index_path, coding)
+        else:
+            # postlists of runs are concatenated (runs have ascending doc_ids)
+            if term_hashes:
+                runs.append(os.path.join(runs_dir, 'run_{}'.format(len(runs))))
+                flush_run(term_hashes, term_words, postings, runs[-1], coding)
+            del term_hashes, term_words, postings
+            with stage('merge'):
+                merge_indexes(runs, index_path)
+    finally:
+        if runs_dir is not None:
+            shutil.rmtree(runs_dir)
+    return docs
+
+def build_index_star(args):
+    """
+    build_index(*args) in pool process, returns (its result, its Profile or None),
+    see profiling.profiled_call
+    """
+    return profiled_call(build_index, *args)
+
+def split_paths(paths, n_parts):
+    """
+    split list of paths into at most n_parts contiguous parts of close total file size
+    """
+    sizes = [os.path.getsize(path) for path in paths]
+    part_size = float(sum(sizes)) / n_parts
+    parts = [[]]
+    total = 0
+    for path, size in zip(paths, sizes):
+        if parts[-1] and total >= part_size * len(parts) and len(parts) < n_parts:
+            parts.append([])
+        parts[-1].append(path)
+        total += size
+    return parts
+
+def build_index_parallel(paths, coding, mem_limit, index_path, n_jobs):
+    """
+    same as build_index(), but contiguous parts of paths are indexed by n_jobs processes.
+    every part is indexed with doc_ids starting from 1, and in merging of part indexes
+    doc_ids of every part are shifted by count of documents in previous parts
+    (so doc_ids are in the same order as documents in paths).
+    every part is read in its indexing process (pool processes can't start producers).
+    """
+    parts = split_paths(paths, n_jobs)
+    parts_dir = tempfile.mkdtemp(prefix='index_parts_', dir='.')
+    part_paths = [os.path.join(parts_dir, 'part_{}'.format(k)) for k in xrange(len(parts))]
+    # part indexes are removed even if indexing fails
+    try:
+        pool = Pool(len(parts))
+        parts_results = pool.map(build_index_star, [
+            (part, coding, mem_limit / len(parts), part_path)
+            for part, part_path in zip(parts, part_paths)
+        ])
+        pool.close()
+        docs = []
+        doc_id_offsets = []
+        for part_docs, part_profile in parts_results:
+            doc_id_offsets.append(len(docs))
+            docs += part_docs
+            add_profile(part_profile)
+        del parts_results
+        with stage('merge'):
+            merge_indexes(part_paths, index_path, doc_id_offsets)
+    finally:
+        shutil.rmtree(parts_dir)
+    return docs
+
+def build_shard(paths, coding, mem_limit, index_path, docs_path):
+    """
+    index documents from files paths into index and docs files (see build_index),
+    returns count of documents
+    """
+    docs = build_index(paths, coding, mem_limit, index_path)
+    write_docs(docs, docs_path)
+    return len(docs)
+
+def build_shard_star(args):
+    """
+    build_shard(*args) in pool process, returns (its result, its Profile or None)
+    """
+    return profiled_call(build_shard, *args)
+
+def build_shards(paths, coding, mem_limit, dir_path, n_shards):
+    """
+    index contiguous parts of paths by n_shards processes into shards of index in dir_path:
+    every part is indexed as segment of segmented index (see segments.py),
+    so shard of document is given by its doc_id (range of doc_ids of every shard is in manifest)
+    """
+    from segments import segment_paths, write_manifest
+    parts = split_paths(paths, n_shards)
+    names = ['shard_{}'.format(k) for k in xrange(len(parts))]
+    pool = Pool(len(parts))
+    shard_results = pool.map(build_shard_star, [
+        (part, coding, mem_limit / len(parts)) + segment_paths(dir_path, name)
+        for part, name in zip(parts, names)
+    ])
+    pool.close()
+    shards = []
+    base = 0
+    for name, (n_docs, shard_profile) in zip(names, shard_results):
+        add_profile(shard_profile)
+        shards.append({'name': name, 'base': base, 'n_docs': n_docs})
+        base += n_docs
+    # shards are not merged into bigger segments (see segments.compact)
+    write_manifest(dir_path, {'generation': 0, 'segments': shards, 'merge': False})
+
+# count of urls in block of docs file
+doc_block_size = 16
+
+def write_docs(docs, path):
+    """
+    write docs file (urls of documents in order of doc_ids) to file path.
+    """
+    n_blocks = (len(docs) + doc_block_size - 1) / doc_block_size
+    offsets = array('L', [4 + 4 + 8 * (n_blocks + 1)])
+    blocks = []
+    for start in xrange(0, len(docs), doc_block_size):
+        block = []
+        prev_url = ''
+        for url in docs[start:start + doc_block_size]:
+            prefix_size = min(len(os.path.commonprefix([prev_url, url])), 2**16 - 1)
+            block.append(struct.pack('=HI', prefix_size, len(url) - prefix_size))
+            block.append(url[prefix_size:])
+            prev_url = url
+        blocks.append(''.join(block))
+        offsets.append(offsets[-1] + len(blocks[-1]))
+    with open(path, 'w') as f:
+        array('I', [len(docs), doc_block_size]).write(f)
+        offsets.write(f)
+        for block in blocks:
+            f.write(block)
+
+def build_segment(paths, coding, mem_limit, dir_path, n_jobs, n_readers):
+    """
+    index documents from files paths as new segment of segmented index in dir_path
+    (see segments.py), small segments are merged in background then
+    """
+    import segments
+    # segment is written near segments and moved to them when it is complete
+    index_path, docs_path = segments.segment_paths(dir_path, 'new_{}'.format(os.getpid()))
+    if n_jobs > 1 and len(paths) > 1:
+        docs = build_index_parallel(paths, coding, mem_limit, index_path, n_jobs)
+    else:
+        docs = build_index(paths, coding, mem_limit, index_path, n_readers)
+    write_docs(docs, docs_path)
+    if not docs:
+        segments.remove_segment(index_path, docs_path)
+        return
+    segments.add_segment(dir_path, index_path, docs_path, len(docs))
+    segments.start_background_compact(dir_path)
+
+def index_files(args):
+    """
+    index files given in command line
+    """
+    coding = args.coding
     if coding is None:
         coding = 'varbyte'
-    doc_id = 1
-    for doc in reader:
-        # print("{:<7} ({:>6} B): {}".format(doc_id, len(doc.text), doc.url))
-        words = doc2words.extract_words(doc.text)
-        docs.append(doc.url.encode('utf-8'))
-        if coding == 'varbyte':
-            for word in words:
-                word = word.encode('utf-8')
-                mm_hash = mmh3_hash(word)
-                if mm_hash not in index:
-                    # index[word] = (postlist, last doc_id)
-                    #    (for easier appending to postlist)
-                    index[mm_hash] = [vb_encode([doc_id]), doc_id]
-                else:
-                    w_pair = index[mm_hash]
-                    if w_pair[1] != doc_id:
-                        vb_append(w_pair[0], doc_id - w_pair[1])
-                        w_pair[1] = doc_id
-        elif coding == 'simple9':
-            for word in words:
-                word = word.encode('utf-8')
-                mm_hash = mmh3_hash(word)
-                if mm_hash not in index:
-                    # index[word] = (postlist, last doc_id, buffer_for_s9)
-                    index[mm_hash] = [array('I'), doc_id, array('I', [doc_id])]
-                else:
-                    w_pair = index[mm_hash]
-                    buf = w_pair[2]
-                    if w_pair[1] != doc_id:
-                        buf.append(doc_id - w_pair[1])
-                        w_pair[1] = doc_id
-                        if len(buf) in buf_len_thres:
-                            read_ = s9_append(w_pair[0], buf)
-                            buf[:] = buf[read_:]
-        doc_id += 1
-    # t2 = datetime.now()
-    # time_elapsed = (t2 - t1).total_seconds()
-    # print("indexing done in {} s (except force_clears in s9)".format(time_elapsed))
-    # t1 = datetime.now()
+    mem_limit = args.memory_limit * 2**20
+    out_dir = args.append if args.append is not None else args.shards
+    if out_dir is not None and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    if args.append is not None:
+        build_segment(args.files, coding, mem_limit, args.append, args.jobs, args.readers)
+    elif args.shards is not None:
+        build_shards(args.files, coding, mem_limit, args.shards, args.jobs)
+    else:
+        if args.jobs > 1 and len(args.files) > 1:
+            docs = build_index_parallel(args.files, coding, mem_limit, 'index', args.jobs)
+        else:
+            docs = build_index(args.files, coding, mem_limit, 'index', args.readers)
+        with stage('write_docs'):
+            write_docs(docs, 'doc_ids')
 
-    # index is ready. serializing it:
-
-    # index file:
-    #   (everything in file is aligned by 4-byte words, even varbyte codes)
-    #
-    #   comp_type / num_buckets; (4 bytes,
-    #       first bit is for post_list compression type (0: varbyte, 1: simple9))
-    #   bucket_sizes_array; (num_buckets * 2 bytes)
-    #   {bucket_1}; ... ; {bucket_N};
-    # bucket_i: (bucket_size is full size of this structure in file)
-    #   num_hashes; (4 bytes)
-    #   hash_1; (8 bytes)
-    #   post_list_1_size; (4 bytes) NOTE: this is the size of encoding.
-    #                               actual size in file =
-    #                               aligned(this) = (this)+(-this)%4
-    #   post_list_1; (aligned(post_list_1_size))
-    #   ...
-    #   hash_m;  (8 bytes)
-    #   post_list_m_size; (4 bytes)
-    #   post_list_m; (aligned(post_list_m_size))
-
-    # docs file:
-    # num_buckets; (4 bytes)
-    # bucket_sizes_array; (bucket_sizes_array_size * 2 bytes)
-    # {bucket_1}; ...; {bucket_M}
-    # bucket_i:
-    #   n_docs; (4 bytes)
-    #   doc_1_id; (4 bytes)
-    #   doc_1_url_size; (4 bytes)
-    #   doc_1_url; (doc_1_url_size)
-    #   ...
-    #   doc_D_id; (4 bytes)
-    #   doc_D_url_size; (4 bytes)
-    #   doc_D_url; (doc_D_url_size)
-
-
-    n_buckets = 2**16 # must be power of 2, but < 2**32
-
-    buckets = [[] for i in xrange(n_buckets)]
-    bucket_sizes = array('I', [4 for i in xrange(n_buckets)]) # 4 -- for 'num_hashes'
-    for mm_hash, item in index.items():
-        arr = item[0]
-        if coding == 'simple9':
-            buf = item[2]
-            if len(buf):
-                s9_append(arr, buf, force_clear=True)
-                buf[:] = buf[0:0]
-        bucket_n = mm_hash & (n_buckets - 1)
-        bucket = buckets[bucket_n]
-        arr_size = arr_size_count(arr)
-        bucket.append([mm_hash, arr_size, arr])
-        bucket_sizes[bucket_n] += 8 + 4 + arr_size + (-arr_size) % 4
-
-    if coding == 'varbyte':
-        comp_nbuc = n_buckets
-    elif coding == 'simple9':
-        comp_nbuc = n_buckets | (1 << 31)
-
-    with open('index', 'w') as f:
-        array('I', [comp_nbuc]).write(f)
-        array('H', bucket_sizes).write(f)
-        for bucket in buckets:
-            num_hashes = len(bucket)
-            array('I', [num_hashes]).write(f)
-            if num_hashes:
-                for (mm_hash, arr_size, arr) in bucket:
-                    array('l', [mm_hash]).write(f)
-                    array('I', [arr_size]).write(f)
-                    arr.write(f)
-                    if coding == 'varbyte':
-                        align_remain = (-arr_size) % 4
-                        if align_remain:
-                            array('B', [0] * align_remain).write(f)
-    del buckets
-    del bucket_sizes
-    n_doc_buckets = 2**12 # must be power of 2, but <= 2**32
-    buckets = [[] for i in xrange(n_doc_buckets)]
-    bucket_sizes = array('I', [4 for i in xrange(n_doc_buckets)]) # 4 -- for 'num_docs'
-    for doc_id, url in zip(xrange(1, len(docs) + 1), docs):
-        bucket_n = doc_id & (n_doc_buckets - 1)
-        bucket = buckets[bucket_n]
-        url_size = len(url)
-        bucket.append((doc_id, url_size, url))
-        bucket_sizes[bucket_n] += 4 + 4 + url_size
-    with open('doc_ids', 'w') as f:
-        array('I', [n_doc_buckets]).write(f)
-        array('H', bucket_sizes).write(f)
-        for bucket in buckets:
-            num_urls = len(bucket)
-            array('I', [num_urls]).write(f)
-            if num_urls:
-                for (doc_id, url_size, url) in bucket:
-                    array('I', [doc_id, url_size]).write(f)
-                    array('B', url).write(f)
-    # t2 = datetime.now()
-    # time_elapsed_ser = (t2 - t1).total_seconds()
-    # print("serializing done in {} s".format(time_elapsed_ser))
-    # print("total: {} s".format(time_elapsed  + time_elapsed_ser))
+if __name__ == '__main__':
+    args = parse_command_line()
+    if args.profile is not None:
+        ProfileWriter(args.profile).run('index', index_files, args)
+    else:
+        index_files(args)
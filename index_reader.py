@@ -0,0 +1,286 @@
+import mmap
+import os
+import struct
+import numpy as np
+from bisect import bisect_left
+from coders import *
+from doc2words import mmh3_hash
+from postlist import Postlist, BitmapPostlist, pl_union_all
+from cache import cache_array
+
+def mmap_file(path):
+    """
+    returns read-only mmap of whole file
+    """
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def lexicon_path(index_path):
+    """
+    returns path of lexicon file of index file index_path (see index.py for format):
+    'index' -> 'lexicon', 'x.index' -> 'x.lexicon', other ones get '.lexicon' suffix
+    """
+    if os.path.basename(index_path) == 'index' or index_path.endswith('.index'):
+        return index_path[:-len('index')] + 'lexicon'
+    return index_path + '.lexicon'
+
+class IndexReader:
+    """
+    index and doc_ids files (see index.py for format), memory-mapped once
+    (docs_path may be None if urls are not needed), and lexicon of index
+    if there is one (terms ending with * are expanded by it, see get_postlists).
+    headers, dictionary and block offsets of doc_ids are read on creation,
+    postlists are handed to decoders as np.arrays over mmap (without copying).
+    """
+
+    def __init__(self, index_path='index', docs_path='doc_ids', postlist_cache=None):
+        """
+        postlist_cache is cache.LRUCache for decoded postlists (keyed by hash of term),
+        postlists are put to it when they are decoded completely
+        """
+        self.index_path = index_path
+        self.index = mmap_file(index_path)
+        self.postlist_cache = postlist_cache
+        codec_id, self.n_terms = struct.unpack_from('=II', self.index, 0)
+        self.coding = codings[codec_id]
+        # dictionary: parallel arrays sorted by hash
+        offset = 4 + 4
+        columns = []
+        for dtype in ('int64', 'uint64', 'uint32', 'uint32', 'uint32', 'uint8'):
+            columns.append(np.frombuffer(self.index, dtype=dtype, count=self.n_terms, offset=offset))
+            offset += self.n_terms * np.dtype(dtype).itemsize
+        self.dict_hashes, self.dict_offsets, self.dict_n_postings, \
+            self.dict_n_blocks, self.dict_pl_sizes, self.dict_codec_ids = columns
+        self.lexicon = None
+        if os.path.exists(lexicon_path(index_path)):
+            self.lexicon = mmap_file(lexicon_path(index_path))
+            self.lexicon_n_terms, self.lexicon_block_size = struct.unpack_from('=II', self.lexicon, 0)
+            n_blocks = (self.lexicon_n_terms + self.lexicon_block_size - 1) / self.lexicon_block_size
+            self.lexicon_block_offsets = np.frombuffer(
+                self.lexicon, dtype='uint64', count=n_blocks + 1, offset=4 + 4
+            )
+        if docs_path is not None:
+            self.docs = mmap_file(docs_path)
+            self.n_docs, self.doc_block_size = struct.unpack_from('=II', self.docs, 0)
+            n_blocks = (self.n_docs + self.doc_block_size - 1) / self.doc_block_size
+            self.doc_block_offsets = np.frombuffer(
+                self.docs, dtype='uint64', count=n_blocks + 1, offset=4 + 4
+            )
+
+    def find_terms(self, terms):
+        """
+        terms is list of input terms
+        returns np.array of positions of terms in dictionary (-1 if term is not in index).
+        if there is lexicon, terms found by hash are checked in it
+        (so other terms with the same hash are not found)
+        """
+        hashes = np.array([mmh3_hash(term) for term in terms], dtype='int64')
+        term_ns = np.searchsorted(self.dict_hashes, hashes)
+        found = term_ns < self.n_terms
+        found[found] = self.dict_hashes[term_ns[found]] == hashes[found]
+        term_ns[~found] = -1
+        if self.lexicon is not None:
+            for idx in np.flatnonzero(found):
+                if self.lexicon_find(terms[idx]) != term_ns[idx]:
+                    term_ns[idx] = -1
+        return term_ns
+
+    def read_postlist(self, term_n):
+        """
+        returns postlist.Postlist (or postlist.BitmapPostlist) of term on position term_n
+        in dictionary (encoded postlist is not copied from mmap)
+        """
+        offset = int(self.dict_offsets[term_n])
+        coding = codings[self.dict_codec_ids[term_n]]
+        if coding == 'bitmap':
+            words = np.frombuffer(self.index, dtype='uint32',
+                count=int(self.dict_pl_sizes[term_n]) / 4, offset=offset)
+            return BitmapPostlist(words[0], words[1:], self.dict_n_postings[term_n])
+        n_blocks = int(self.dict_n_blocks[term_n])
+        skips = np.frombuffer(
+            self.index, dtype='uint32', count=3 * n_blocks, offset=offset
+        ).reshape(3, n_blocks)
+        data = np.frombuffer(self.index, dtype='uint8',
+            count=int(self.dict_pl_sizes[term_n]), offset=offset + 3 * 4 * n_blocks)
+        decode = decoders[coding]
+        return Postlist(data, self.dict_n_postings[term_n],
+            skips[0], skips[1], skips[2], decode)
+
+    def read_postlist_data(self, term_n):
+        """
+        returns np.array (uint8) over mmap with encoded postlist of term on position term_n
+        in dictionary, postlist must be one block without skip table (not a bitmap)
+        """
+        return np.frombuffer(self.index, dtype='uint8', count=int(self.dict_pl_sizes[term_n]),
+                             offset=int(self.dict_offsets[term_n]))
+
+    def get_postlists(self, terms):
+        """
+        terms is list of input terms
+        gets postlists for all input terms and place them in the same order
+        returns list of postlists (postlist is postlist.Postlist, it is decoded lazily,
+        or np.array of docIDs if postlist is in postlist_cache,
+        or empty np.array if term is not in index)
+
+        terms are found with binary search in dictionary,
+        and postlists are read in ascending order of offsets (in one direction).
+        term ending with * (wildcard) gets union of postlists of all terms
+        starting with the rest of it (see wildcard_postlist)
+        """
+        term_ns = self.find_terms(terms)
+        ans = [np.array([], dtype='int64') for i in xrange(len(terms))]
+        wildcards = [idx for idx, term in enumerate(terms) if term.endswith('*')]
+        term_ns[wildcards] = -1
+        for idx in wildcards:
+            ans[idx] = self.wildcard_postlist(terms[idx])
+        postlists = {}
+        found = np.flatnonzero(term_ns >= 0)
+        for idx in found[np.argsort(self.dict_offsets[term_ns[found]], kind='mergesort')]:
+            term_n = term_ns[idx]
+            if term_n not in postlists:
+                postlists[term_n] = self._cached_postlist(term_n)
+            ans[idx] = postlists[term_n]
+        return ans
+
+    def wildcard_postlist(self, term):
+        """
+        returns union of postlists of terms of lexicon starting with term without last *
+        (empty np.array if there is no lexicon), union is put to postlist_cache by term
+        """
+        if self.postlist_cache is not None:
+            docids = self.postlist_cache.get(term)
+            if docids is not None:
+                return docids
+        term_ns = self.expand_prefix(term[:-1])
+        if len(term_ns) == 1:
+            return self._cached_postlist(term_ns[0])
+        term_ns.sort(key=lambda term_n: self.dict_offsets[term_n])
+        docids = pl_union_all([self.read_postlist(term_n) for term_n in term_ns])
+        if self.postlist_cache is not None:
+            cache_array(self.postlist_cache, term, docids)
+        return docids
+
+    def read_lexicon_block(self, block_n):
+        """
+        returns (terms, term_ns) of block block_n of lexicon (see index.py for format)
+        """
+        pos = int(self.lexicon_block_offsets[block_n])
+        end = int(self.lexicon_block_offsets[block_n + 1])
+        terms = []
+        term_ns = []
+        term = ''
+        while pos < end:
+            prefix_size, suffix_size, term_n = struct.unpack_from('=HII', self.lexicon, pos)
+            pos += 10
+            term = term[:prefix_size] + self.lexicon[pos:pos + suffix_size]
+            pos += suffix_size
+            terms.append(term)
+            term_ns.append(term_n)
+        return terms, term_ns
+
+    def iter_lexicon(self):
+        """
+        generates (term, term_n) of all terms of lexicon in ascending order of terms
+        """
+        for block_n in xrange(len(self.lexicon_block_offsets) - 1):
+            for entry in zip(*self.read_lexicon_block(block_n)):
+                yield entry
+
+    def _lexicon_block_of(self, term):
+        """
+        returns number of the last block of lexicon which first term is not greater than term
+        (0 if there is no one), blocks are found by binary search by their first terms
+        (first term of block is not front-coded)
+        """
+        lo, hi = 0, len(self.lexicon_block_offsets) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) / 2
+            pos = int(self.lexicon_block_offsets[mid])
+            suffix_size = struct.unpack_from('=I', self.lexicon, pos + 2)[0]
+            if self.lexicon[pos + 10:pos + 10 + suffix_size] <= term:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def lexicon_find(self, term):
+        """
+        returns position in dictionary of term found in lexicon (-1 if it is not there)
+        """
+        if not self.lexicon_n_terms:
+            return -1
+        terms, term_ns = self.read_lexicon_block(self._lexicon_block_of(term))
+        idx = bisect_left(terms, term)
+        if idx < len(terms) and terms[idx] == term:
+            return term_ns[idx]
+        return -1
+
+    def expand_prefix(self, prefix):
+        """
+        returns list of positions in dictionary of terms of lexicon starting with prefix
+        (empty if there is no lexicon). terms starting with prefix are one after another
+        in lexicon, they are read from the block where prefix would be
+        """
+        if self.lexicon is None or not self.lexicon_n_terms:
+            return []
+        ans = []
+        for block_n in xrange(self._lexicon_block_of(prefix), len(self.lexicon_block_offsets) - 1):
+            for term, term_n in zip(*self.read_lexicon_block(block_n)):
+                if term.startswith(prefix):
+                    ans.append(term_n)
+                elif term > prefix:
+                    return ans
+        return ans
+
+    def _cached_postlist(self, term_n):
+        """
+        returns decoded postlist of term_n from postlist_cache,
+        or Postlist which puts itself to postlist_cache when decoded
+        """
+        if self.postlist_cache is None:
+            return self.read_postlist(term_n)
+        mm_hash = int(self.dict_hashes[term_n])
+        docids = self.postlist_cache.get(mm_hash)
+        if docids is not None:
+            return docids
+        postlist = self.read_postlist(term_n)
+        postlist.cache, postlist.cache_key = self.postlist_cache, mm_hash
+        return postlist
+
+    def read_url_block(self, block_n):
+        """
+        returns list of urls of block block_n of doc_ids (see index.py for format)
+        """
+        pos = int(self.doc_block_offsets[block_n])
+        end = int(self.doc_block_offsets[block_n + 1])
+        urls = []
+        url = ''
+        while pos < end:
+            prefix_size, suffix_size = struct.unpack_from('=HI', self.docs, pos)
+            pos += 6
+            url = url[:prefix_size] + self.docs[pos:pos + suffix_size]
+            pos += suffix_size
+            urls.append(url)
+        return urls
+
+    def get_urls(self, input_docids):
+        """
+        input_docids is list of input docIDs
+        gets urls for all input docIDs and place them in the same order
+        returns list of urls (url is string, None for unknown docID)
+
+        block of docID is found by its number, and every block is decoded once
+        for consecutive docIDs of the same block (so sorted docIDs are read in one direction)
+        """
+        ans = []
+        block_n = None
+        for docid in input_docids:
+            pos = int(docid) - 1
+            if not 0 <= pos < self.n_docs:
+                ans.append(None)
+                continue
+            if pos / self.doc_block_size != block_n:
+                block_n = pos / self.doc_block_size
+                urls = self.read_url_block(block_n)
+            ans.append(urls[pos % self.doc_block_size])
+        return ans
@@ -0,0 +1,215 @@
+import heapq
+import struct
+import os
+from collections import defaultdict
+import numpy as np
+from array import array
+from coders import codings, decoders
+from index_reader import IndexReader, lexicon_path
+from postlist import encode_postlist, encode_postlists, concat_postlists, is_dense, skip_block_size
+
+def arr_size_count(arr):
+    return arr.buffer_info()[1] * arr.itemsize
+
+class IndexWriter:
+    """
+    writes index file (see index.py for format) postlist by postlist.
+    count of terms must be known in advance (dictionary is placed before postlist records).
+    postlists may be added in any order, records are written in order of adding,
+    and dictionary is sorted by hash in close().
+    """
+
+    def __init__(self, path, coding, n_terms):
+        """
+        coding is default coding of index (postlists may be encoded with other codings)
+        """
+        self.f = open(path, 'wb')
+        self.coding = coding
+        self.n_terms = n_terms
+        self.hashes = array('l')
+        self.offsets = array('L')
+        self.n_postings = array('I')
+        self.n_blocks = array('I')
+        self.pl_sizes = array('I')
+        self.codec_ids = array('B')
+        dict_size = 4 + 4 + n_terms * (8 + 8 + 4 + 4 + 4 + 1)
+        self.offset = dict_size + (-dict_size) % 8
+        self.f.seek(self.offset)
+
+    def add(self, mm_hash, n_postings, skips, arr, coding):
+        """
+        write postlist record of term with hash mm_hash.
+        skips is array obj with skip table entries (first doc_id, count of postings
+        before block, offset of block) one after another, empty if postlist is one block.
+        arr is array obj with postlist encoded with coding.
+        """
+        arr_size = arr_size_count(arr)
+        self.hashes.append(mm_hash)
+        self.offsets.append(self.offset)
+        self.n_postings.append(n_postings)
+        self.n_blocks.append(len(skips) / 3)
+        self.pl_sizes.append(arr_size)
+        self.codec_ids.append(codings.index(coding))
+        for k in xrange(3):
+            skips[k::3].write(self.f)
+        arr.write(self.f)
+        align_remain = (-arr_size) % 4
+        if align_remain:
+            array('B', [0] * align_remain).write(self.f)
+        self.offset += arr_size_count(skips) + arr_size + align_remain
+
+    def close(self):
+        assert(len(self.hashes) == self.n_terms)
+        order = np.argsort(np.frombuffer(self.hashes, dtype='int64'))
+        self.f.seek(0)
+        array('I', [codings.index(self.coding), self.n_terms]).write(self.f)
+        for column in (self.hashes, self.offsets, self.n_postings,
+                       self.n_blocks, self.pl_sizes, self.codec_ids):
+            # typecodes of array objs are the same as numpy ones
+            self.f.write(np.frombuffer(column, dtype=column.typecode)[order].tostring())
+        self.f.close()
+
+# count of terms in block of lexicon file
+lexicon_block_size = 16
+
+def write_lexicon(entries, path):
+    """
+    write lexicon file (see index.py for format) to file path.
+    entries is iterable of (term, position of term in dictionary of index)
+    in ascending order of terms (utf-8 strings), without repeated terms
+    """
+    n_terms = 0
+    blocks = []
+    block = []
+    prev_term = ''
+    for term, term_n in entries:
+        if n_terms % lexicon_block_size == 0:
+            if block:
+                blocks.append(''.join(block))
+            block = []
+            prev_term = ''
+        prefix_size = min(len(os.path.commonprefix([prev_term, term])), 2**16 - 1)
+        block.append(struct.pack('=HII', prefix_size, len(term) - prefix_size, term_n))
+        block.append(term[prefix_size:])
+        prev_term = term
+        n_terms += 1
+    if block:
+        blocks.append(''.join(block))
+    offsets = array('L', [4 + 4 + 8 * (len(blocks) + 1)])
+    for block in blocks:
+        offsets.append(offsets[-1] + len(block))
+    with open(path, 'wb') as f:
+        array('I', [n_terms, lexicon_block_size]).write(f)
+        offsets.write(f)
+        for block in blocks:
+            f.write(block)
+
+def merge_lexicons(readers, path):
+    """
+    write lexicon of index file path merged from indexes of readers (index_reader.IndexReader)
+    with their lexicons (k-way merge of sorted lexicons, terms are found in merged
+    dictionary by hashes from dictionaries of their indexes)
+    """
+    merged_hashes = IndexReader(path, docs_path=None).dict_hashes
+    def entries(reader):
+        for term, term_n in reader.iter_lexicon():
+            yield term, int(np.searchsorted(merged_hashes, reader.dict_hashes[term_n]))
+    def unique(entries):
+        last_term = None
+        for term, term_n in entries:
+            if term != last_term:
+                yield term, term_n
+            last_term = term
+    write_lexicon(unique(heapq.merge(*[entries(reader) for reader in readers])), lexicon_path(path))
+
+# count of postings of short postlists encoded at once by merge_indexes
+short_postings_batch = 2**16
+
+def write_short_postlists(writer, short_postlists):
+    """
+    decode and encode postlists of short_postlists at once by every coding,
+    add them to IndexWriter writer and clear short_postlists.
+    short_postlists is dict: coding -> list of (hash of term, list of pieces of its postlist:
+    (encoded postlist of one block, count of postings, number added to its docIDs)).
+    first delta of postlist of one block is its first docID, so encoded pieces
+    are decoded together, and docIDs of every piece are counted from its first delta
+    """
+    for coding, postlists in short_postlists.items():
+        pieces = [piece for mm_hash, term_pieces in postlists for piece in term_pieces]
+        deltas = decoders[coding](np.concatenate([data for data, n, offset in pieces]))
+        piece_lens = np.array([n for data, n, offset in pieces])
+        assert(len(deltas) == piece_lens.sum())
+        piece_starts = np.cumsum(piece_lens) - piece_lens
+        docids = np.cumsum(deltas)
+        piece_offsets = np.array([offset for data, n, offset in pieces])
+        docids += np.repeat(deltas[piece_starts] - docids[piece_starts] + piece_offsets, piece_lens)
+        term_lens = np.array([sum(n for data, n, offset in term_pieces)
+                              for mm_hash, term_pieces in postlists])
+        encoded = encode_postlists(docids, np.cumsum(term_lens) - term_lens, coding)
+        for (mm_hash, term_pieces), (n, skips, arr) in zip(postlists, encoded):
+            writer.add(int(mm_hash), n, skips, arr, coding)
+    short_postlists.clear()
+
+def merge_indexes(paths, path, doc_id_offsets=None):
+    """
+    merge indexes from files paths into one index file path (k-way merge of dictionaries),
+    postlists of the same term are concatenated in order of paths.
+    doc_id_offsets is list of numbers added to docIDs of every index (zeros by default),
+    all docIDs of every index must be greater than docIDs of previous ones.
+    blocks of postlists are copied without decoding if they have the same coding
+    in all indexes (see concat_postlists), bitmaps are decoded
+    (and postlist is stored as bitmap again if it is dense).
+    lexicons are merged too if all indexes have them.
+    """
+    if doc_id_offsets is None:
+        doc_id_offsets = [0] * len(paths)
+    readers = [IndexReader(index_path, docs_path=None) for index_path in paths]
+    # dictionaries of readers (memory-mapped) are walked by positions,
+    # only merged hashes are in memory (8 bytes per term)
+    hashes = np.unique(np.concatenate([reader.dict_hashes for reader in readers]))
+    positions = [0] * len(readers)
+    writer = IndexWriter(path, readers[0].coding, len(hashes))
+    # postlists of one block which are concatenated from several ones are decoded
+    # and encoded again (see concat_postlists), many of them at once (see write_short_postlists)
+    short_postlists = defaultdict(list)
+    n_short_postings = 0
+    for mm_hash in hashes:
+        term_readers = []
+        for k, reader in enumerate(readers):
+            term_n = positions[k]
+            if term_n < reader.n_terms and reader.dict_hashes[term_n] == mm_hash:
+                term_readers.append((reader, term_n, doc_id_offsets[k]))
+                positions[k] += 1
+        term_codings = set(codings[reader.dict_codec_ids[term_n]]
+                           for reader, term_n, offset in term_readers)
+        n_postings = sum(int(reader.dict_n_postings[term_n])
+                         for reader, term_n, offset in term_readers)
+        if len(term_codings) == 1 and 'bitmap' not in term_codings:
+            coding = term_codings.pop()
+            if n_postings <= skip_block_size and (len(term_readers) > 1 or term_readers[0][2]) \
+                    and not any(reader.dict_n_blocks[term_n] for reader, term_n, offset in term_readers):
+                short_postlists[coding].append((mm_hash, [
+                    (reader.read_postlist_data(term_n), int(reader.dict_n_postings[term_n]), offset)
+                    for reader, term_n, offset in term_readers
+                ]))
+                n_short_postings += n_postings
+                if n_short_postings >= short_postings_batch:
+                    write_short_postlists(writer, short_postlists)
+                    n_short_postings = 0
+                continue
+            postlists = [reader.read_postlist(term_n) for reader, term_n, offset in term_readers]
+            offsets = [offset for reader, term_n, offset in term_readers]
+            n_postings, skips, arr = concat_postlists(postlists, offsets, coding)
+        else:
+            docids = np.concatenate([
+                reader.read_postlist(term_n).decode() + offset for reader, term_n, offset in term_readers
+            ])
+            coding = 'bitmap' if is_dense(n_postings, docids[-1] - docids[0] + 1) else writer.coding
+            skips, arr = encode_postlist(docids, coding)
+        writer.add(int(mm_hash), n_postings, skips, arr, coding)
+    write_short_postlists(writer, short_postlists)
+    writer.close()
+    if all(reader.lexicon is not None for reader in readers):
+        merge_lexicons(readers, path)
+    elif os.path.exists(lexicon_path(path)):
+        os.unlink(lexicon_path(path))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import os
+import numpy as np
+from coders import codings
+from index_reader import IndexReader
+from index_writer import IndexWriter, arr_size_count
+from postlist import encode_postlists, encode_bitmap, is_dense
+
+# count of postings of postlists encoded at once
+batch_postings = 2**18
+
+def encode_best(postlists):
+    """
+    postlists is list of sorted np.arrays of docIDs.
+    encodes all postlists with every coding at once (see postlist.encode_postlists)
+    and takes the smallest encoding (with skip table) of every postlist.
+    bitmap is tried only for dense postlists (see postlist.is_dense).
+    returns list of (skips, arr, coding) of every postlist, see postlist.encode_postlist
+    """
+    n_postings = np.array([len(docids) for docids in postlists])
+    all_docids = np.concatenate(postlists)
+    term_starts = np.cumsum(n_postings) - n_postings
+    dense = is_dense(n_postings, np.array([docids[-1] - docids[0] + 1 for docids in postlists]))
+    best = [None] * len(postlists)
+    for coding in codings:
+        if coding == 'bitmap':
+            encoded = ((k, encode_bitmap(postlists[k])) for k in np.flatnonzero(dense))
+        else:
+            encoded = ((k, (skips, arr)) for k, (n, skips, arr)
+                       in enumerate(encode_postlists(all_docids, term_starts, coding)))
+        for k, (skips, arr) in encoded:
+            size = arr_size_count(arr) + (-arr_size_count(arr)) % 4 + arr_size_count(skips)
+            if best[k] is None or size < best[k][0]:
+                best[k] = (size, skips, arr, coding)
+    return [encoding[1:] for encoding in best]
+
+def write_best(writer, hashes, postlists):
+    """
+    add postlists (with hashes of their terms) to IndexWriter writer, see encode_best
+    """
+    for mm_hash, docids, (skips, arr, coding) in zip(hashes, postlists, encode_best(postlists)):
+        writer.add(mm_hash, len(docids), skips, arr, coding)
+
+if __name__ == '__main__':
+    # index written by index.py is read as is,
+    # optimized index is written near it and replaces it in the end
+    reader = IndexReader(docs_path=None)
+    writer = IndexWriter('index.tmp', reader.coding, reader.n_terms)
+    # postlists are written in the same order as dictionary, by batches
+    hashes = []
+    postlists = []
+    n_postings = 0
+    for term_n in xrange(reader.n_terms):
+        postlists.append(reader.read_postlist(term_n).decode())
+        hashes.append(int(reader.dict_hashes[term_n]))
+        n_postings += len(postlists[-1])
+        if n_postings >= batch_postings:
+            write_best(writer, hashes, postlists)
+            hashes = []
+            postlists = []
+            n_postings = 0
+    if postlists:
+        write_best(writer, hashes, postlists)
+    writer.close()
+    os.rename('index.tmp', 'index')
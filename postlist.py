@@ -0,0 +1,426 @@
+import numpy as np
+from array import array
+from coders import arr_types, block_encoders
+from cache import cache_array
+from profiling import stage, count
+
+# count of postings in block of postlist (every block but the last one is full).
+# there is a skip table entry for every block, so blocks can be decoded independently.
+skip_block_size = 128
+# postlists concatenated by merging (see concat_postlists) may have shorter blocks,
+# every block but the last one has at least min_block_size postings then
+min_block_size = skip_block_size / 2
+
+# postlists with at least bitmap_min_postings postings, which have at least one posting
+# for every bitmap_max_gap docIDs of their range, are stored as bitmaps
+# (bitmap is not larger than varbyte encoding then)
+bitmap_min_postings = skip_block_size
+bitmap_max_gap = 8
+
+class Postlist:
+    """
+    postlist read from index: encoded deltas split into blocks + skip table (see index.py for format).
+    decoding is lazy: intersect() decodes only blocks which can contain required docIDs.
+    """
+
+    def __init__(self, data, n_postings, firsts, starts, offsets, decode):
+        """
+        data is np.array (uint8) with encoded deltas of all blocks.
+        firsts, starts, offsets are skip table: first docID, count of postings before block
+        and offset of block in data (in bytes) for every block.
+        skip table is empty if postlist is one block (then first delta is first docID).
+        decode is func(part of data) -> np.array of deltas
+        """
+        self.data = data
+        self.n_postings = int(n_postings)
+        self.firsts = np.asarray(firsts, dtype='int64')
+        self.starts = np.asarray(starts, dtype='int64')
+        self.offsets = np.append(np.asarray(offsets, dtype='int64'), len(data))
+        self.decode_deltas = decode
+        # cache.LRUCache for decoded postlist and key of postlist in it (see IndexReader)
+        self.cache = None
+        self.cache_key = None
+
+    def __len__(self):
+        return self.n_postings
+
+    def decode(self):
+        """
+        returns np.array (int64) of all docIDs of postlist
+        """
+        with stage('decode'):
+            docids = self._decode()
+        count('postings_decoded', len(docids))
+        count('bytes_read', self.encoded_size())
+        if self.cache is not None:
+            cache_array(self.cache, self.cache_key, docids)
+        return docids
+
+    def encoded_size(self):
+        """
+        returns size of encoded postlist with skip table (in bytes)
+        """
+        return self.data.nbytes + 3 * 4 * len(self.firsts)
+
+    def _decode(self):
+        with stage('decode_deltas'):
+            deltas = self.decode_deltas(self.data)
+        with stage('cumsum'):
+            docids = np.cumsum(deltas)
+        if len(self.firsts):
+            # first delta of block is not used: docIDs of block are counted from first docID in skip table
+            block_lens = np.diff(np.append(self.starts, len(docids)))
+            docids += np.repeat(self.firsts - docids[self.starts], block_lens)
+        return docids
+
+    def decode_block(self, block_n):
+        """
+        returns np.array (int64) of docIDs of block block_n
+        """
+        data = self.data[self.offsets[block_n]:self.offsets[block_n + 1]]
+        with stage('decode'):
+            docids = np.cumsum(self.decode_deltas(data))
+            docids += self.firsts[block_n] - docids[0]
+        count('postings_decoded', len(docids))
+        count('bytes_read', data.nbytes + 3 * 4)
+        return docids
+
+    def intersect(self, docids):
+        """
+        docids is sorted np.array of unique docIDs.
+        returns np.array of docIDs from docids which are in this postlist.
+        blocks are found by binary search in skip table, and only blocks
+        which can contain docids are decoded.
+        """
+        if not len(self.firsts) or not len(docids):
+            return np.intersect1d(docids, self.decode(), assume_unique=True)
+        block_nums = np.unique(np.searchsorted(self.firsts, docids, side='right') - 1)
+        block_nums = block_nums[block_nums >= 0]
+        if len(block_nums) * 4 > len(self.firsts):
+            # most of blocks are required anyway, decoding all at once is faster
+            found = self.decode()
+        elif len(block_nums):
+            found = np.concatenate([self.decode_block(block_n) for block_n in block_nums])
+        else:
+            return np.array([], dtype='int64')
+        return np.intersect1d(docids, found, assume_unique=True)
+
+class BitmapPostlist(Postlist):
+    """
+    postlist as bitmap: bit k of words (counting from the lowest bit of the first word)
+    is set if docID base + k is in postlist (base is multiple of 32).
+    bitmap postlist is one block without skip table, intersect() tests bits of docIDs
+    without decoding, and bitmaps are combined word by word (see bitmap_and etc.)
+    """
+
+    def __init__(self, base, words, n_postings=None):
+        """
+        words is np.array (uint32), n_postings is counted if it is not known
+        """
+        self.base = int(base)
+        self.words = words
+        if n_postings is None:
+            n_postings = np.unpackbits(words.view('uint8')).sum()
+        self.n_postings = int(n_postings)
+        self.firsts = self.starts = np.array([], dtype='int64')
+        self.cache = None
+        self.cache_key = None
+
+    def encoded_size(self):
+        return 4 + self.words.nbytes
+
+    def _decode(self):
+        # np.unpackbits starts from the highest bit of byte
+        bits = np.unpackbits(self.words.view('uint8')).reshape(-1, 8)[:, ::-1]
+        return np.flatnonzero(bits.ravel()) + self.base
+
+    def end(self):
+        """
+        returns docID after the last bit of bitmap
+        """
+        return self.base + 32 * len(self.words)
+
+    def intersect(self, docids):
+        pos = docids - self.base
+        docids = docids[(pos >= 0) & (pos < 32 * len(self.words))]
+        pos = docids - self.base
+        bits = (self.words[pos >> 5] >> (pos & 31).astype('uint32')) & 1
+        return docids[bits.astype(bool)]
+
+def bitmap_from_docids(docids):
+    """
+    docids is sorted np.array of docIDs.
+    returns BitmapPostlist of docids
+    """
+    if not len(docids):
+        return BitmapPostlist(0, np.array([], dtype='uint32'), 0)
+    base = int(docids[0]) & ~31
+    pos = docids - base
+    bits = np.zeros((pos[-1] // 32 + 1) * 32, dtype=bool)
+    bits[pos] = True
+    words = np.packbits(bits.reshape(-1, 8)[:, ::-1]).view('uint32')
+    return BitmapPostlist(base, words, len(docids))
+
+def _bitmap_slice(bitmap, start, end):
+    """
+    returns words of bitmap for docIDs from start to end (multiples of 32 within bitmap)
+    """
+    return bitmap.words[(start - bitmap.base) >> 5:(end - bitmap.base) >> 5]
+
+def bitmap_and(bitmaps):
+    """
+    returns BitmapPostlist of intersection of BitmapPostlists
+    """
+    start = max(bitmap.base for bitmap in bitmaps)
+    end = min(bitmap.end() for bitmap in bitmaps)
+    if end <= start:
+        return BitmapPostlist(0, np.array([], dtype='uint32'), 0)
+    words = _bitmap_slice(bitmaps[0], start, end).copy()
+    for bitmap in bitmaps[1:]:
+        words &= _bitmap_slice(bitmap, start, end)
+    return BitmapPostlist(start, words)
+
+def bitmap_or(bitmaps):
+    """
+    returns BitmapPostlist of union of BitmapPostlists
+    """
+    bitmaps = [bitmap for bitmap in bitmaps if len(bitmap.words)]
+    if not bitmaps:
+        return BitmapPostlist(0, np.array([], dtype='uint32'), 0)
+    start = min(bitmap.base for bitmap in bitmaps)
+    end = max(bitmap.end() for bitmap in bitmaps)
+    words = np.zeros((end - start) >> 5, dtype='uint32')
+    for bitmap in bitmaps:
+        words[(bitmap.base - start) >> 5:(bitmap.end() - start) >> 5] |= bitmap.words
+    return BitmapPostlist(start, words)
+
+def bitmap_and_not(bitmap, excluded):
+    """
+    returns BitmapPostlist of docIDs of bitmap which are not in any of BitmapPostlists excluded
+    """
+    words = bitmap.words.copy()
+    for other in excluded:
+        start = max(bitmap.base, other.base)
+        end = min(bitmap.end(), other.end())
+        if start < end:
+            words[(start - bitmap.base) >> 5:(end - bitmap.base) >> 5] &= ~_bitmap_slice(other, start, end)
+    return BitmapPostlist(bitmap.base, words)
+
+def split_bitmaps(postlists):
+    """
+    returns (list of BitmapPostlists from postlists, list of other postlists)
+    """
+    bitmaps = [postlist for postlist in postlists if isinstance(postlist, BitmapPostlist)]
+    others = [postlist for postlist in postlists if not isinstance(postlist, BitmapPostlist)]
+    return bitmaps, others
+
+def is_dense(n_postings, n_docids):
+    """
+    returns True if postlist of n_postings postings within range of n_docids docIDs
+    should be stored as bitmap (np.arrays of counts may be given as well)
+    """
+    return (n_postings >= bitmap_min_postings) & (n_docids <= n_postings * bitmap_max_gap)
+
+def encode_bitmap(docids):
+    """
+    docids is sorted np.array of docIDs.
+    returns (skips, arr) of bitmap postlist (see encode_postlist):
+    arr is base docID and words of bitmap (see BitmapPostlist)
+    """
+    bitmap = bitmap_from_docids(docids)
+    arr = array('I', [bitmap.base])
+    arr.fromstring(bitmap.words.tostring())
+    return array('I'), arr
+
+def pl_to_array(postlist):
+    """
+    postlist is Postlist or np.array of docIDs.
+    returns np.array of docIDs
+    """
+    if isinstance(postlist, Postlist):
+        return postlist.decode()
+    return postlist
+
+def pl_union_all(postlists):
+    """
+    returns np.array of docIDs of union of all postlists (k-way union at once).
+    docIDs are marked in bool array over their range if it is not much larger
+    than count of postings, otherwise they are sorted
+    """
+    if not postlists:
+        return np.array([], dtype='int64')
+    docids = np.concatenate([pl_to_array(postlist) for postlist in postlists]).astype('int64')
+    if not len(docids):
+        return docids
+    lo, hi = docids.min(), docids.max()
+    if hi - lo < bitmap_max_gap * len(docids):
+        marks = np.zeros(hi - lo + 1, dtype=bool)
+        marks[docids - lo] = True
+        return np.flatnonzero(marks) + lo
+    return np.unique(docids)
+
+def pl_intersect_with(docids, postlist):
+    """
+    docids is sorted np.array of unique docIDs, postlist is Postlist or np.array of docIDs.
+    returns np.array of docIDs from docids which are in postlist.
+    """
+    if isinstance(postlist, Postlist):
+        return postlist.intersect(docids)
+    return np.intersect1d(docids, postlist, assume_unique=True)
+
+def encode_postlists(docids, term_starts, coding):
+    """
+    docids is np.array with postlists of several terms one after another (every postlist
+    is sorted and not empty), term_starts is np.array of positions where postlists start.
+    encodes deltas of all postlists with coding at once (see coders.block_encoders),
+    every postlist is split into blocks of skip_block_size postings.
+    generates (n_postings, skips, arr) for every postlist, see encode_postlist
+    """
+    docids = np.asarray(docids, dtype='int64')
+    term_starts = np.asarray(term_starts, dtype='int64')
+    n_postings = np.diff(np.append(term_starts, len(docids)))
+    deltas = np.ediff1d(docids, to_begin=docids[:1])
+    # first delta of postlist is first docID itself
+    deltas[term_starts] = docids[term_starts]
+    n_blocks = (n_postings + skip_block_size - 1) // skip_block_size
+    term_blocks = np.cumsum(n_blocks) - n_blocks
+    block_ns = np.arange(n_blocks.sum()) - np.repeat(term_blocks, n_blocks)
+    block_starts = np.repeat(term_starts, n_blocks) + block_ns * skip_block_size
+    code, code_starts = block_encoders[coding](deltas, block_starts)
+    # offsets of blocks in bytes
+    block_offsets = np.append(code_starts * code.dtype.itemsize, code.nbytes)
+    code = code.view('uint8')
+    arr_type = arr_types[coding]
+    # skip table entries of all blocks (first docID, count of postings before block, offset of block)
+    skips = np.empty((len(block_starts), 3), dtype='uint32')
+    skips[:, 0] = docids[block_starts]
+    skips[:, 1] = block_ns * skip_block_size
+    for term_n in xrange(len(term_starts)):
+        first_block = term_blocks[term_n]
+        last_block = first_block + n_blocks[term_n]
+        start, end = block_offsets[first_block], block_offsets[last_block]
+        arr = array(arr_type, code[start:end].tostring())
+        if n_blocks[term_n] > 1:
+            skips[first_block:last_block, 2] = block_offsets[first_block:last_block] - start
+            term_skips = array('I', skips[first_block:last_block].tostring())
+        else:
+            # one block: first delta is first docID itself, skip table is not needed
+            term_skips = array('I')
+        yield int(n_postings[term_n]), term_skips, arr
+
+def encode_postlists_hybrid(docids, term_starts, coding):
+    """
+    same as encode_postlists(), but dense postlists (see is_dense) are stored as bitmaps.
+    generates (n_postings, skips, arr, coding of postlist) for every postlist
+    """
+    docids = np.asarray(docids, dtype='int64')
+    term_starts = np.asarray(term_starts, dtype='int64')
+    term_ends = np.append(term_starts[1:], len(docids))
+    n_postings = term_ends - term_starts
+    dense = is_dense(n_postings, docids[term_ends - 1] - docids[term_starts] + 1)
+    sparse_n_postings = n_postings[~dense]
+    sparse_postlists = encode_postlists(
+        docids[np.repeat(~dense, n_postings)],
+        np.cumsum(sparse_n_postings) - sparse_n_postings, coding
+    )
+    for term_n in xrange(len(term_starts)):
+        if dense[term_n]:
+            skips, arr = encode_bitmap(docids[term_starts[term_n]:term_ends[term_n]])
+            yield int(n_postings[term_n]), skips, arr, 'bitmap'
+        else:
+            yield next(sparse_postlists) + (coding,)
+
+def encode_postlist(docids, coding):
+    """
+    docids is sorted np.array of docIDs.
+    encodes deltas of docids with coding (see coders.block_encoders), block by block
+    ('bitmap' coding: docids are stored as bitmap, see encode_bitmap).
+    returns (skips, arr): skips is array obj with skip table entries (first docID,
+    count of postings before block, offset of block) one after another
+    (empty if postlist is one block), arr is array obj with encoded postlist.
+    """
+    if coding == 'bitmap':
+        return encode_bitmap(docids)
+    _, skips, arr = next(encode_postlists(docids, [0], coding))
+    return skips, arr
+
+def concat_postlists(postlists, doc_id_offsets, coding):
+    """
+    postlists is list of Postlist encoded with coding,
+    doc_id_offsets is list of numbers added to docIDs of every postlist.
+    all docIDs of every postlist (after adding offset) must be greater than docIDs of previous ones.
+    blocks are copied without decoding, only skip tables are shifted. last block of postlist
+    shorter than min_block_size is decoded and joined with first block of next postlist
+    (or with next postlists if they are one short block), and joined postings are encoded again
+    as one block or two ones of about the same size, so every block but the last one
+    has at least min_block_size postings, and at most one block is decoded between postlists.
+    returns (n_postings, skips, arr), see encode_postlist (arr is array obj of bytes)
+    """
+    if len(postlists) == 1 and not len(postlists[0].firsts) and not doc_id_offsets[0]:
+        return len(postlists[0]), array('I'), array('B', postlists[0].data.tostring())
+    n_postings = sum(len(postlist) for postlist in postlists)
+    if n_postings <= skip_block_size:
+        # one block without skip table
+        skips, arr = encode_postlist(np.concatenate([
+            postlist.decode() + doc_id_offset for postlist, doc_id_offset in zip(postlists, doc_id_offsets)
+        ]), coding)
+        return n_postings, skips, array('B', arr.tostring())
+    skips = array('I')
+    arr = array('B')
+    n_written = 0
+    # decoded postings which are not written yet (less than min_block_size)
+    pending = np.array([], dtype='int64')
+    for postlist, doc_id_offset in zip(postlists, doc_id_offsets):
+        if len(postlist.firsts):
+            firsts, starts, offsets = postlist.firsts, postlist.starts, postlist.offsets
+            decode_block = postlist.decode_block
+        else:
+            # one block without skip table (first delta is first docID)
+            docids = postlist.decode()
+            firsts, starts, offsets = docids[:1], [0], [0, len(postlist.data)]
+            decode_block = lambda block_n: docids
+        n_blocks = len(firsts)
+        last_block_len = len(postlist) - int(starts[-1])
+        block_n = 0
+        if len(pending):
+            pending = np.concatenate([pending, decode_block(0) + doc_id_offset])
+            block_n = 1
+            if len(pending) < min_block_size and block_n == n_blocks:
+                continue
+            if len(pending) > skip_block_size:
+                half = len(pending) // 2
+                _append_blocks(skips, arr, n_written, pending[:half], coding)
+                _append_blocks(skips, arr, n_written + half, pending[half:], coding)
+            else:
+                _append_blocks(skips, arr, n_written, pending, coding)
+            n_written += len(pending)
+            pending = pending[:0]
+        # short last block is left for next postlist
+        end = n_blocks - 1 if last_block_len < min_block_size else n_blocks
+        if block_n < end:
+            start_offset = int(offsets[block_n])
+            for k in xrange(block_n, end):
+                skips.extend([int(firsts[k]) + doc_id_offset,
+                              n_written + int(starts[k] - starts[block_n]),
+                              int(offsets[k]) - start_offset + len(arr)])
+            arr.fromstring(postlist.data[start_offset:int(offsets[end])].tostring())
+            n_written += (int(starts[end]) if end < n_blocks else len(postlist)) - int(starts[block_n])
+        if block_n <= end < n_blocks:
+            pending = decode_block(end) + doc_id_offset
+    if len(pending):
+        _append_blocks(skips, arr, n_written, pending, coding)
+    return n_postings, skips, arr
+
+def _append_blocks(skips, arr, n_written, docids, coding):
+    """
+    encode docids (see encode_postlist) and append their blocks to postlist being concatenated:
+    skip table entries to array obj skips, encoded blocks to array obj arr (of bytes).
+    n_written is count of postings in postlist before docids
+    """
+    block_skips, block_arr = encode_postlist(docids, coding)
+    if not len(block_skips):
+        block_skips = [docids[0], 0, 0]
+    for k in xrange(0, len(block_skips), 3):
+        skips.extend([int(block_skips[k]), int(block_skips[k + 1]) + n_written,
+                      int(block_skips[k + 2]) + len(arr)])
+    arr.fromstring(block_arr.tostring())
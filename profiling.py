@@ -0,0 +1,187 @@
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# opt-in instrumentation (search.py, search_server.py and index.py --profile):
+# while profile is active in thread (see ProfileWriter), stage() measures wall time
+# of stage of work, count() adds to counter and record_size() records size of
+# intermediate result. without active profile they do nothing.
+# every profile is written as one json line:
+#   {"name": ..., "total_ms": ..., "stages_ms": {stage: ms}, "counters": {counter: n},
+#    "per_s": {counter: n / total time}, "sizes": [[operation, size], ...]}
+# time of stage includes time of stages inside it (e.g. decode is inside execute).
+# stages and counters:
+#   search_server.Searcher: parse, get_postlists, plan, execute, get_urls, shards (--workers);
+#       results, urls, queries (of batch), result_cache_hits
+#   postlist.Postlist: decode (decode_deltas and cumsum inside it if whole postlist is decoded);
+#       postings_decoded, bytes_read
+#   sizes: sizes of results of & (and) and | (or) of query_parser.Parser.execute()
+#   index.py: flush, merge, write_docs; docs, tokens (words of documents), postings
+#       (distinct words of documents), flushes; sizes: postings of every flush.
+#       stages and counters of parts indexed by pool processes (--jobs, --shards)
+#       are summed (so times of stages of parts may be greater than total time)
+
+_state = threading.local()
+
+class Profile:
+    """
+    stages, counters and sizes of one query (or of other work)
+    """
+
+    def __init__(self, name):
+        # name may be raw query, which is not always valid utf-8
+        self.name = name.decode('utf-8', 'replace') if isinstance(name, str) else name
+        self.total = 0.0
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.sizes = []
+
+    def record(self):
+        """
+        returns profile as dict (see above)
+        """
+        return {
+            'name': self.name, 'total_ms': self.total * 1000.0,
+            'stages_ms': dict((stage, t * 1000.0) for stage, t in self.stages.items()),
+            'counters': dict(self.counters), 'sizes': self.sizes,
+            'per_s': dict((counter, n / self.total) for counter, n in self.counters.items())
+                if self.total else {},
+        }
+
+    def add(self, other):
+        """
+        add stages, counters and sizes of other profile (e.g. of work of other process)
+        """
+        for stage, t in other.stages.items():
+            self.stages[stage] += t
+        for counter, n in other.counters.items():
+            self.counters[counter] += n
+        self.sizes.extend(other.sizes)
+
+class _Stage:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        self.profile.stages[self.name] += time.time() - self.start
+
+class _NoStage:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_stage = _NoStage()
+
+def current():
+    """
+    returns active Profile of thread (None if there is no one)
+    """
+    return getattr(_state, 'profile', None)
+
+def stage(name):
+    """
+    returns context manager measuring time of stage name in active profile
+    """
+    profile = getattr(_state, 'profile', None)
+    if profile is None:
+        return _no_stage
+    return _Stage(profile, name)
+
+def count(name, n=1):
+    profile = getattr(_state, 'profile', None)
+    if profile is not None:
+        profile.counters[name] += n
+
+def record_size(op, size):
+    profile = getattr(_state, 'profile', None)
+    if profile is not None:
+        profile.sizes.append((op, size))
+
+def run_profiled(profile, func, *args):
+    """
+    returns func(*args) called with active profile
+    """
+    prev = current()
+    _state.profile = profile
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        profile.total += time.time() - start
+        _state.profile = prev
+
+def profiled_call(func, *args):
+    """
+    for pool processes (forked while profile is active): returns (func(*args),
+    Profile of the call) if profile is active, else (func(*args), None).
+    profile is returned to parent process, which adds it to its one (see add_profile)
+    """
+    if current() is None:
+        return func(*args), None
+    profile = Profile(func.__name__)
+    return run_profiled(profile, func, *args), profile
+
+def add_profile(profile):
+    """
+    add profile (may be None) to active profile (see Profile.add)
+    """
+    active = getattr(_state, 'profile', None)
+    if active is not None and profile is not None:
+        active.add(profile)
+
+class ProfileWriter:
+    """
+    runs work with active profile and writes profiles as json lines
+    to file path ('-' for stderr), may be shared by threads
+    """
+
+    def __init__(self, path):
+        self.f = sys.stderr if path == '-' else open(path, 'a')
+        self.lock = threading.Lock()
+
+    def write(self, profile):
+        line = json.dumps(profile.record(), sort_keys=True)
+        with self.lock:
+            self.f.write(line + '\n')
+            self.f.flush()
+
+    def run(self, name, func, *args):
+        """
+        returns func(*args) called with active profile name, which is written then
+        """
+        profile = Profile(name)
+        try:
+            return run_profiled(profile, func, *args)
+        finally:
+            self.write(profile)
+
+    def run_parts(self, name, func, *args):
+        """
+        generates parts of func(*args) (iterable), profile name is active
+        while func is called and while every part is generated (not between parts)
+        """
+        profile = Profile(name)
+        parts = None
+        while True:
+            prev = current()
+            _state.profile = profile
+            start = time.time()
+            try:
+                if parts is None:
+                    parts = iter(func(*args))
+                part = next(parts)
+            except StopIteration:
+                break
+            finally:
+                profile.total += time.time() - start
+                _state.profile = prev
+            yield part
+        self.write(profile)
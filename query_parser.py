@@ -1,5 +1,11 @@
 import re
+from array import array
 import numpy as np
+from postlist import pl_to_array, pl_intersect_with, split_bitmaps, \
+    bitmap_and, bitmap_or, bitmap_and_not, bitmap_from_docids
+from cache import cache_array
+from profiling import stage, count, record_size
+from cursors import PostlistCursor, AndNotCursor, and_cursor, or_cursor, iter_cursor
 
 class Parser:
     """
@@ -12,12 +18,15 @@ class Parser:
     # 3 ~ &
     # 4 ~ !
 
-    def __init__(self, postlists_getter):
+    def __init__(self, postlists_getter, result_cache=None):
         """
         postlists_getter is func(list of terms) -> list of postlists on the same positions in list
+        result_cache is cache.LRUCache for results of subexpressions (see _rpn_op_exec),
+        used by execute()
         """
         self.rgx = re.compile('([&|!() ])')
         self.get_postlists = postlists_getter
+        self.result_cache = result_cache
 
     def parse(self, query):
         self.stack = []
@@ -38,19 +47,138 @@ class Parser:
         if self._can_get_token():
             raise Exception('syntax error')
 
+    def parsed_query(self):
+        """
+        returns parsed query (terms and RPN stack), which may be executed
+        by other Parser (e.g. in other process, see set_parsed_query)
+        """
+        return self.terms, self.stack
+
+    def set_parsed_query(self, parsed):
+        """
+        take query parsed by other Parser (see parsed_query) instead of parse()
+        """
+        terms, stack = parsed
+        self.terms = list(terms)
+        self.stack = list(stack)
+        self.postlists = []
+
     def prepare_postlists(self):
         """
-        get all postlists required for doing execute() within one-direction file-read
+        get all postlists required for doing execute() within one-direction file-read,
+        and plan the query with sizes of postlists (see plan())
+        """
+        with stage('get_postlists'):
+            self.postlists = self.get_postlists(self.terms)
+        with stage('plan'):
+            self.plan()
+
+    def plan(self):
+        """
+        rewrite RPN stack of parsed query (postlists must be prepared):
+        nested & in & and | in | are flattened, double ! is removed,
+        operands are ordered by estimated size (count of postings), so intersection
+        starts from the rarest operand, and & with an empty finite operand is replaced
+        with empty postlist (its other operands are not executed at all).
+        "infinite" operands of & (!x) are still subtracted after intersection (see pl_intersect)
+        """
+        tree = self._rpn_tree()
+        self.stack = []
+        self._rpn_emit(self._plan_node(tree)[0])
+
+    def _rpn_tree(self):
+        """
+        pop subexpression from RPN stack and return it as tree:
+        (0, term number, True) or (4, operand, finite) or (2 or 3, list of operands, finite)
+        """
+        type, arg, finite = self.stack.pop()
+        if type == 4:
+            return (4, self._rpn_tree(), finite)
+        elif type in {2, 3}:
+            t, arg_n, _ = self.stack.pop()
+            assert(t == 1)
+            return (type, [self._rpn_tree() for k in xrange(arg_n)], finite)
+        return (type, arg, finite)
+
+    def _plan_node(self, node):
+        """
+        returns (planned node, estimated count of postings in result of node)
+        (estimate of "infinite" node is estimate of its complement)
+        """
+        type, arg, finite = node
+        if type == 0:
+            return node, len(self.postlists[arg])
+        elif type == 4:
+            opnd, est = self._plan_node(arg)
+            if opnd[0] == 4:
+                return opnd[1], est
+            return (4, opnd, finite), est
+        opnds = []
+        for opnd, est in map(self._plan_node, arg):
+            if opnd[0] == type:
+                opnds += opnd[1]
+            else:
+                opnds.append((opnd, est))
+        # estimates of finite operands of & / infinite operands of infinite |
+        ests_pos = [est for opnd, est in opnds if opnd[2] == finite]
+        if type == 3 and finite:
+            est = min(ests_pos)
+            if not est:
+                self.terms.append('')
+                self.postlists.append(np.array([], dtype='int64'))
+                return (0, len(self.terms) - 1, True), 0
+        elif type == 2 and not finite:
+            est = min(ests_pos)
+        else:
+            est = sum(est for opnd, est in opnds)
+        # operands are popped from RPN stack in reverse order, so the rarest is the last one
+        opnds.sort(key=lambda item: item[1], reverse=True)
+        return (type, opnds, finite), est
+
+    def _rpn_emit(self, node):
+        """
+        push planned node to RPN stack (operands of & and | are (node, estimate) pairs)
         """
-        self.postlists = self.get_postlists(self.terms)
+        type, arg, finite = node
+        if type == 4:
+            self._rpn_emit(arg)
+            self.stack.append((4, None, finite))
+        elif type in {2, 3}:
+            for opnd, est in arg:
+                self._rpn_emit(opnd)
+            self.stack.extend([(1, len(arg), None), (type, None, finite)])
+        else:
+            self.stack.append(node)
 
     def execute(self):
-        res, finite = self._rpn_op_exec(self.stack.pop())
+        res, finite, _ = self._rpn_op_exec(self.stack.pop())
+        if self.stack:
+            raise Exception('non empty stack')
+        if not finite:
+            raise Exception('bad query')
+        return pl_to_array(res)
+
+    def execute_stream(self):
+        """
+        same as execute(), but query tree is compiled into tree of cursors (see cursors.py),
+        and docIDs are generated one by one in ascending order,
+        without materializing postlists of operands.
+        """
+        cursor, finite = self._rpn_op_cursor(self.stack.pop())
         if self.stack:
             raise Exception('non empty stack')
         if not finite:
             raise Exception('bad query')
-        return res
+        return iter_cursor(cursor)
+
+    def results(self, stream=False):
+        """
+        returns docIDs of results by execute() (or execute_stream() if stream)
+        """
+        with stage('execute'):
+            if stream:
+                return array('I', self.execute_stream())
+            return self.execute()
 
     def _get_token(self):
         token = self.tokens[self.start]
@@ -71,6 +199,9 @@ class Parser:
             assert(self._can_get_token() and self._get_token() == ')')
         else:
             assert(token not in ['|', '&', '!'])
+            # * may be only the last char of term: wildcard, term gets postlists
+            # of all terms starting with the rest of it (see IndexReader.get_postlists)
+            assert('*' not in token[:-1])
             finite = True
             self.terms.append(token)
             self.stack.append((0, len(self.terms) - 1, finite))
@@ -96,10 +227,7 @@ class Parser:
                 self.start += 1
             elif token in ['|', ')']:
                 break
-            if token == '(':
-                finite |= self._opnd()
-            else:
-                finite |= self._rd_not()
+            finite |= self._rd_not()
             arg_n += 1
         if arg_n > 1:
             self.stack.extend([(1, arg_n, None), (3, None, finite)])
@@ -117,52 +245,143 @@ class Parser:
         return finite
 
     def pl_intersect(self, postlists_fin, postlists_inf):
-        from functools import partial
-        func = partial(np.intersect1d, assume_unique=True)
-        inter_fin = reduce(func, postlists_fin) if postlists_fin else []
-        inter_inf = reduce(func, postlists_inf) if postlists_inf else []
-        return np.setdiff1d(inter_fin, inter_inf).astype('int64')
+        """
+        returns intersection of postlists_fin without docs from any of postlists_inf.
+        starts from the shortest postlist, other postlists are only probed with current result
+        (postlists may be postlist.Postlist, then only required blocks of them are decoded,
+        or postlist.BitmapPostlist, then bits of docIDs are tested without decoding)
+        """
+        if not postlists_fin:
+            return np.array([], dtype='int64')
+        # bitmaps are intersected word by word, and if all postlists_fin are bitmaps,
+        # bitmaps of postlists_inf are subtracted from the result word by word as well
+        bitmaps, postlists_fin = split_bitmaps(postlists_fin)
+        if bitmaps:
+            bitmap = bitmap_and(bitmaps) if len(bitmaps) > 1 else bitmaps[0]
+            if not postlists_fin:
+                bitmaps_inf, postlists_inf = split_bitmaps(postlists_inf)
+                if bitmaps_inf:
+                    bitmap = bitmap_and_not(bitmap, bitmaps_inf)
+            postlists_fin.append(bitmap)
+        postlists_fin = sorted(postlists_fin, key=len)
+        res = pl_to_array(postlists_fin[0])
+        for postlist in postlists_fin[1:]:
+            if not len(res):
+                break
+            res = pl_intersect_with(res, postlist)
+        for postlist in postlists_inf:
+            if not len(res):
+                break
+            res = np.setdiff1d(res, pl_intersect_with(res, postlist), assume_unique=True)
+        return np.asarray(res).astype('int64')
 
     def pl_union(self, postlists):
+        """
+        returns union of postlists. if some of them are postlist.BitmapPostlist,
+        other postlists are put to bitmap of union, and it is decoded once
+        """
+        bitmaps, others = split_bitmaps(postlists)
+        if bitmaps:
+            others = [bitmap_from_docids(pl_to_array(postlist)) for postlist in others]
+            return bitmap_or(bitmaps + others).decode()
         return np.array(
-            reduce(np.union1d, postlists)
+            reduce(np.union1d, map(pl_to_array, postlists))
         ).astype('int64') if postlists else np.array([])
 
     def _rpn_op_exec(self, op):
+        """
+        returns (result, finite, key): key is canonical form of subexpression
+        (term, or operation with sorted keys of operands), results of & and |
+        are put to result_cache by key and taken from it instead of computing
+        """
         type, arg, finite = op
         if type == 0:
-            return self.postlists[arg], True
+            return self.postlists[arg], True, self.terms[arg]
         elif type in {2, 3}:
             t, arg_n, _ = self.stack.pop()
             assert(t == 1)
             args_fin = []
             args_inf = []
+            keys = []
             for k in xrange(arg_n):
                 opnd = self.stack.pop()
-                opnd_res, arg_finite = self._rpn_op_exec(opnd)
+                opnd_res, arg_finite, opnd_key = self._rpn_op_exec(opnd)
+                keys.append(opnd_key)
                 if arg_finite:
                     args_fin.append(opnd_res)
                 else:
                     args_inf.append(opnd_res)
+            key = (type, tuple(sorted(keys)))
+            if self.result_cache is not None:
+                res = self.result_cache.get(key)
+                if res is not None:
+                    count('result_cache_hits')
+                    return res, finite, key
             if type == 2:
                 # |
                 if finite:
                     assert(not args_inf)
-                    return self.pl_union(args_fin), finite
+                    res = self.pl_union(args_fin)
                 else:
                     assert(args_inf)
-                    return self.pl_intersect(args_inf, args_fin), finite
+                    res = self.pl_intersect(args_inf, args_fin)
             else:
                 # &
                 if finite:
                     assert(args_fin)
-                    return self.pl_intersect(args_fin, args_inf), finite
+                    res = self.pl_intersect(args_fin, args_inf)
                 else:
                     assert(not args_fin)
-                    return self.pl_union(args_inf), finite
+                    res = self.pl_union(args_inf)
+            record_size('or' if type == 2 else 'and', len(res))
+            if self.result_cache is not None:
+                cache_array(self.result_cache, key, res)
+            return res, finite, key
+        elif type == 4:
+            opnd = self.stack.pop()
+            res, finite, key = self._rpn_op_exec(opnd)
+            return res, not finite, (4, key)
+        else:
+            raise Exception('execution error')
+
+    def _rpn_op_cursor(self, op):
+        """
+        same as _rpn_op_exec(), but returns cursor instead of postlist.
+        cursor of "infinite" result is cursor over its complement.
+        """
+        type, arg, finite = op
+        if type == 0:
+            return PostlistCursor(self.postlists[arg]), True
+        elif type in {2, 3}:
+            t, arg_n, _ = self.stack.pop()
+            assert(t == 1)
+            args_fin = []
+            args_inf = []
+            for k in xrange(arg_n):
+                opnd = self.stack.pop()
+                opnd_res, arg_finite = self._rpn_op_cursor(opnd)
+                if arg_finite:
+                    args_fin.append(opnd_res)
+                else:
+                    args_inf.append(opnd_res)
+            if (type == 2) == finite:
+                # finite | or infinite &
+                assert(not (args_inf if finite else args_fin))
+                return or_cursor(args_fin or args_inf), finite
+            else:
+                # finite & or infinite |
+                if finite:
+                    args_pos, args_neg = args_fin, args_inf
+                else:
+                    args_pos, args_neg = args_inf, args_fin
+                assert(args_pos)
+                cursor = and_cursor(args_pos)
+                if args_neg:
+                    cursor = AndNotCursor(cursor, or_cursor(args_neg))
+                return cursor, finite
         elif type == 4:
             opnd = self.stack.pop()
-            res, finite = self._rpn_op_exec(opnd)
+            res, finite = self._rpn_op_cursor(opnd)
             return res, not finite
         else:
             raise Exception('execution error')
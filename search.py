@@ -1,183 +1,104 @@
 from __future__ import print_function
-from coders import *
-import mmh3
-import numpy as np
-from collections import defaultdict
-from array import array
-from index import mmh3_hash
-from query_parser import Parser
-from functools import partial
+import argparse
+import socket
+import sys
+from search_protocol import send_message, recv_message, \
+    add_output_arguments, add_profile_argument
 # from datetime import datetime
 
-def get_postlists(terms, f, coding, n_buckets, buckets_offset, bucket_sizes):
-    """
-    terms is list of input terms
-    gets delta_postlists for all input terms and place them in the same order
-    returns list of delta_postlists (delta_postlist is list of numbers: postlist in deltas format)
-    actual postlist is cumsum of delta_postlist
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='boolean search, queries are read from stdin')
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='evaluate queries document-at-a-time with posting cursors '
+                             '(docIDs are streamed into compact array instead of '
+                             'intersecting full postlists)')
+    parser.add_argument('--socket', type=str, default=None,
+                        action='store', dest='socket',
+                        help='send queries to search daemon listening on this unix socket '
+                             '(see search_server.py) instead of opening index')
+    local = parser.add_argument_group('local search (not used with --socket)')
+    local.add_argument('--segments', type=str, default=None,
+                       action='store', dest='segments',
+                       help='search in segmented index in this directory (see index.py --append) '
+                            'instead of index and doc_ids')
+    local.add_argument('--workers', action='store_true', dest='workers',
+                       help='execute queries in every segment (shard) of --segments '
+                            'by its own worker process in parallel')
+    local.add_argument('--batch', type=int, default=1,
+                       action='store', dest='batch',
+                       help='count of queries answered together: postlists of all terms '
+                            'of batch are read in one pass and shared by queries (default: 1)')
+    local.add_argument('--cache-mb', type=int, default=128,
+                       action='store', dest='cache_mb',
+                       help='Memory budget for caches of decoded postlists and query results, '
+                            'MB (default: 128, 0: no caches)')
+    add_output_arguments(local)
+    add_profile_argument(local)
+    local.add_argument('--cache-stats', action='store_true', dest='cache_stats',
+                       help='print counters of caches to stderr in the end')
+    return parser.parse_args()
 
-    f is file, must be opened with 'r', function won't close it.
-    function will run through f file in one direction and take only required postlists
-    (and check postlists in the same buckets as required postlists)
+def read_queries():
+    while True:
+        try:
+            yield raw_input()
+        except EOFError:
+            break
 
-    last 4 parameters are from beginning of file f
+def search_remote(socket_path):
     """
-    if coding == 'varbyte':
-        decode = vb_decode
-    elif coding == 'simple9':
-        decode = partial(s9_decode, remove_zeros=True)
-    hashes = defaultdict(list)
-    hash_idx = defaultdict(list)
-    for idx, term in enumerate(terms):
-        mm_hash = mmh3_hash(term)
-        hash_idx[mm_hash].append(idx)
-        bucket_n = mm_hash & (n_buckets - 1)
-        hashes[bucket_n].append(mm_hash)
-    ans = [[] for i in xrange(len(terms))]
-    if not hashes:
-        return ans
-    bucket_nums = sorted(hashes.keys())
-    max_bucket_n = bucket_nums[-1]
-    bucket_locs = np.cumsum([0] + list(bucket_sizes[:max_bucket_n]))
-    for bucket_n in bucket_nums:
-        f.seek(buckets_offset + bucket_locs[bucket_n])
-        query_hashes = set(hashes[bucket_n])
-        if not query_hashes:
-            continue
-        arr = array('I')
-        arr.read(f, 1)
-        n_hashes = arr[0]
-        for i in xrange(n_hashes):
-            arr = array('l')
-            arr.read(f, 1)
-            mm_hash = arr[0]
-            arr = array('I')
-            arr.read(f, 1)
-            pl_size = arr[0]
-            if mm_hash in query_hashes:
-                query_hashes -= {mm_hash}
-                if coding == 'varbyte':
-                    arr = array('B')
-                    arr.read(f, pl_size)
-                    f.seek(f.tell() + (-pl_size) % 4)
-                elif coding == 'simple9':
-                    arr = array('I')
-                    arr.read(f, pl_size / 4)
-                pl_deltas = decode(arr)
-                for idx in hash_idx[mm_hash]:
-                    ans[idx] = list(pl_deltas) # copy
-                if not query_hashes:
-                    break
-            else:
-                f.seek(f.tell() + pl_size + (-pl_size) % 4)
-    return ans
-
-def get_urls(input_docids, f, n_buckets, buckets_offset, bucket_sizes):
+    thin client: every query is answered by search daemon (index is not opened here)
     """
-    input_docids is list of input docIDs
-    gets urls for all input docIDs and place them in the same order
-    returns list of urls (url is string)
-
-    f is file, must be opened with 'r', function won't close it.
-    function will run through f file in one direction and take only required urls
-    (and check urls in the same buckets as required urls)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    for query in read_queries():
+        send_message(sock, query)
+        answer = recv_message(sock)
+        if answer is None:
+            raise Exception('connection closed by search daemon')
+        sys.stdout.write(answer)
+    sock.close()
 
-    last 3 parameters are from beginning of file f
+def search_local(stream, batch_size, cache_size, **searcher_args):
     """
-    if not len(input_docids):
-        return []
-    docid_idx = defaultdict(list)
-    docids = defaultdict(list)
-    for idx, docid in enumerate(input_docids):
-        docid_idx[docid].append(idx)
-        bucket_n = docid & (n_buckets - 1)
-        docids[bucket_n].append(docid)
-    ans = [None for i in xrange(len(input_docids))]
-    if not docids:
-        return ans
-    bucket_nums = sorted(docids.keys())
-    max_bucket_n = bucket_nums[-1]
-    bucket_locs = np.cumsum([0] + list(bucket_sizes[:max_bucket_n]))
-    for bucket_n in bucket_nums:
-        f.seek(buckets_offset + bucket_locs[bucket_n])
-        query_docids = set(docids[bucket_n])
-        if not query_docids:
-            continue
-        arr = array('I')
-        arr.read(f, 1)
-        n_docids = arr[0]
-        for i in xrange(n_docids):
-            arr = array('I')
-            arr.read(f, 2)
-            docid, url_size = arr
-            if docid in query_docids:
-                query_docids -= {docid}
-                arr = array('B')
-                arr.read(f, url_size)
-                url = arr.tostring()
-                for idx in docid_idx[docid]:
-                    ans[idx] = url # copy
-                if not query_docids:
-                    break
-            else:
-                f.seek(f.tell() + url_size)
-    return ans
+    answers queries from stdin, returns Searcher which answered them.
+    output is written by parts as urls are resolved (see Searcher.iter_answer()),
+    searcher_args are other arguments of Searcher
+    """
+    searcher = Searcher(stream, cache_size=cache_size, **searcher_args)
+    if batch_size > 1:
+        batch = []
+        for query in read_queries():
+            batch.append(query)
+            if len(batch) == batch_size:
+                write_parts(searcher.iter_answer_batch(batch))
+                batch = []
+        write_parts(searcher.iter_answer_batch(batch))
+        return searcher
+    for query in read_queries():
+        # t1 = datetime.now()
+        write_parts(searcher.iter_answer(query))
+        # t2 = datetime.now()
+        # time_elapsed = (t2-t1).total_seconds()
+        # print("answered in {} ms".format(time_elapsed * 1000.0))
+    return searcher
+
+def write_parts(parts):
+    for part in parts:
+        sys.stdout.write(part)
 
 if __name__ == '__main__':
-    with open('index', 'r') as f:
-        arr = array('I')
-        arr.read(f, 1)
-        comp_nbuc = arr[0]
-        comp_type = comp_nbuc >> 31
-        n_buckets = comp_nbuc & ((1 << 31) - 1)
-        if comp_type == 0:
-            coding = 'varbyte'
-            decode = vb_decode
-        elif comp_type == 1:
-            coding = 'simple9'
-            decode = s9_decode
-        bucket_sizes = array('H')
-        bucket_sizes.read(f, n_buckets)
-        buckets_offset = f.tell()
-        postlists_getter = lambda terms: \
-            [np.cumsum(postlist) for postlist in get_postlists(
-                terms, f, coding, n_buckets, buckets_offset, bucket_sizes
-            )]
-        parser = Parser(postlists_getter)
-        while True:
-            try:
-                query = raw_input()
-                print(query)
-            except EOFError:
-                break
-            # t1 = datetime.now()
-            if not query:
-                continue
-            try:
-                parser.parse(query)
-            except Exception as e:
-                print('PARSING ERROR:', e)
-                continue
-            parser.prepare_postlists()
-            ans = parser.execute()
-            assert(sorted(ans) == list(ans))
-            print(len(ans))
-            if not len(ans):
-                # t2 = datetime.now()
-                # time_elapsed = (t2-t1).total_seconds()
-                # print('nothing found, took {} ms'.format(time_elapsed * 1000.0))
-                continue
-            with open('doc_ids', 'r') as f_docs:
-                arr = array('I')
-                arr.read(f_docs, 1)
-                n_doc_buckets = arr[0]
-                doc_buc_sizes = array('H')
-                doc_buc_sizes.read(f_docs, n_doc_buckets)
-                doc_buc_offset = f_docs.tell()
-                urls = get_urls(ans, f_docs, n_doc_buckets,
-                    doc_buc_offset, doc_buc_sizes)
-                # t2 = datetime.now()
-                for url in urls:
-                    print(url)
-            # time_elapsed = (t2-t1).total_seconds()
-            # print("found {} docs in {} ms".format(len(ans), time_elapsed * 1000.0))
+    args = parse_command_line()
+    if args.socket is not None:
+        search_remote(args.socket)
+    else:
+        # index modules (and numpy) are imported only here, so client starts fast
+        from search_server import Searcher, print_cache_stats
+        searcher = search_local(args.stream, args.batch, args.cache_mb * 2**20,
+                                count_only=args.count_only, offset=args.offset, limit=args.limit,
+                                segments_dir=args.segments, workers=args.workers,
+                                profile_path=args.profile)
+        if args.cache_stats:
+            print_cache_stats(searcher)
+        if searcher.pool is not None:
+            searcher.pool.close()
@@ -1 +1 @@
-python2.7 search.py
+python2.7 search.py "$@"
@@ -0,0 +1,53 @@
+import struct
+
+# protocol (over unix domain socket, any count of queries per connection):
+#   request: query_size (4 bytes); query (query_size bytes, one line without '\n')
+#   response: answer_size (4 bytes); answer (answer_size bytes, the same lines
+#       as search.py prints for the query: query, count of results, urls)
+# this module is imported by thin client (search.py --socket), so it does not import
+# index modules (and numpy): arguments shared by search.py and search_server.py are here too
+
+def recv_exact(sock, size):
+    """
+    returns size bytes read from sock (less if connection is closed)
+    """
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+def send_message(sock, msg):
+    sock.sendall(struct.pack('=I', len(msg)) + msg)
+
+def recv_message(sock):
+    """
+    returns message (see protocol above) or None if connection is closed
+    """
+    header = recv_exact(sock, 4)
+    if len(header) < 4:
+        return None
+    return recv_exact(sock, struct.unpack('=I', header)[0])
+
+def add_output_arguments(parser):
+    """
+    add arguments of output mode (see search_server.Searcher) to argparse parser
+    """
+    parser.add_argument('--count-only', action='store_true', dest='count_only',
+                        help='output only count of results for every query (doc_ids is not read)')
+    parser.add_argument('--offset', type=int, default=0,
+                        action='store', dest='offset',
+                        help='output urls of results starting from this one (default: 0)')
+    parser.add_argument('--limit', type=int, default=None,
+                        action='store', dest='limit',
+                        help='output urls of at most this count of results (default: all)')
+
+def add_profile_argument(parser):
+    parser.add_argument('--profile', type=str, default=None,
+                        action='store', dest='profile',
+                        help='write profile of every query (time of stages, postings decoded, '
+                             'sizes of intermediate results) as json line to this file '
+                             '(- for stderr), see profiling.py')
@@ -0,0 +1,323 @@
+from __future__ import print_function
+import argparse
+import json
+import os
+import signal
+import sys
+import SocketServer
+from collections import defaultdict
+import numpy as np
+from index_reader import IndexReader
+from query_parser import Parser
+from cache import LRUCache
+from segments import SegmentedIndex
+from shards import ShardPool
+from profiling import ProfileWriter, stage, count
+from postlist import pl_to_array
+from search_protocol import send_message, recv_message, \
+    add_output_arguments, add_profile_argument
+
+# count of urls resolved and printed at once
+url_chunk_size = 1024
+
+class Searcher:
+    """
+    answers queries with index opened once (index and doc_ids are memory-mapped),
+    or with segmented index (see segments.py): query is evaluated in every segment,
+    and results of segments are output one after another (in order of doc_ids).
+    segments (shards) may be evaluated in parallel by worker processes (see shards.py)
+    """
+
+    def __init__(self, stream=False, index_path='index', docs_path='doc_ids', cache_size=0,
+                 count_only=False, offset=0, limit=None, segments_dir=None, workers=False,
+                 profile_path=None):
+        """
+        stream: evaluate queries with posting cursors (see search.py --stream)
+        cache_size is memory budget (in bytes) for caches of decoded postlists and
+        results of subexpressions (half for each one, no caches if 0)
+        count_only: output only count of results (urls are not resolved)
+        offset, limit: output urls only of results from offset to offset + limit
+        (count of results is count of all results anyway)
+        segments_dir: directory of segmented index to use instead of index_path and docs_path
+        (segments merged or added later are used by next queries)
+        workers: execute queries in every segment by its own worker process
+        (caches are in workers then)
+        profile_path: write profile of every query to this file ('-' for stderr),
+        see profiling.py
+        """
+        self.profiler = ProfileWriter(profile_path) if profile_path is not None else None
+        self.postlist_cache = self.result_cache = self.pool = None
+        if workers:
+            self.pool = ShardPool(stream, cache_size)
+        elif cache_size:
+            self.postlist_cache = LRUCache(cache_size / 2)
+            self.result_cache = LRUCache(cache_size / 2)
+        if segments_dir is None:
+            reader = IndexReader(index_path, None if count_only else docs_path, self.postlist_cache)
+            segments = [(0, reader, self.result_cache)]
+            self.segments = lambda: segments
+        else:
+            self.segments = SegmentedIndex(segments_dir, not count_only,
+                                           self.postlist_cache, self.result_cache).segments
+        self.stream = stream
+        self.count_only = count_only
+        self.offset = offset
+        self.limit = limit
+
+    def cache_stats(self):
+        """
+        returns dict with counters of caches (empty if there are no caches)
+        """
+        if self.pool is not None:
+            return self.pool.cache_stats()
+        if self.postlist_cache is None:
+            return {}
+        return {'postlists': self.postlist_cache.stats(), 'results': self.result_cache.stats()}
+
+    def answer(self, query):
+        """
+        returns output of search for query (string of lines, see search.py)
+        """
+        return ''.join(self.iter_answer(query))
+
+    def iter_answer(self, query):
+        """
+        generates output of search for query by parts (see answer()),
+        urls are resolved by chunks when previous part is taken
+        """
+        return self._profiled_parts(query, self._iter_answer, query)
+
+    def _iter_answer(self, query):
+        if self.pool is not None:
+            return self._iter_answer_pool([query])
+        if not query:
+            return iter(['\n'])
+        segments = self.segments()
+        parsers = [Parser(reader.get_postlists, result_cache) for base, reader, result_cache in segments]
+        try:
+            self._parse(query, parsers)
+        except Exception as e:
+            return iter([self._parsing_error(query, e)])
+        return self._execute(query, [reader for base, reader, result_cache in segments], parsers)
+
+    def iter_answer_batch(self, queries):
+        """
+        generates outputs of search for queries by parts (see iter_answer()).
+        all queries are parsed first, then postlists of all their terms are read
+        at once (every postlist once, in ascending order of offsets, segment by segment),
+        and postlists of terms which are in several queries are decoded once
+        (or all queries are executed by workers at once).
+        """
+        if self.pool is not None:
+            for part in self._profiled_parts('batch', self._iter_answer_pool, queries):
+                yield part
+            return
+        readers, query_parsers = self._profiled('batch', self._prepare_batch, queries)
+        for query, parsers in zip(queries, query_parsers):
+            if not query:
+                yield '\n'
+            elif isinstance(parsers, Exception):
+                yield self._parsing_error(query, parsers)
+            else:
+                for part in self._profiled_parts(query, self._execute, query, readers, parsers):
+                    yield part
+
+    def _prepare_batch(self, queries):
+        """
+        parse queries and read postlists of their terms (see iter_answer_batch())
+        returns (readers of segments, list of parsers of every query
+        or parsing exception or None for empty query)
+        """
+        count('queries', len(queries))
+        segments = self.segments()
+        segment_postlists = [{} for segment in segments]
+        query_parsers = []
+        term_counts = defaultdict(int)
+        for query in queries:
+            if not query:
+                query_parsers.append(None)
+                continue
+            parsers = [
+                Parser(lambda terms, postlists=postlists: [postlists[term] for term in terms], result_cache)
+                for (base, reader, result_cache), postlists in zip(segments, segment_postlists)
+            ]
+            try:
+                self._parse(query, parsers)
+            except Exception as e:
+                query_parsers.append(e)
+                continue
+            if parsers:
+                for term in set(parsers[0].terms):
+                    term_counts[term] += 1
+            query_parsers.append(parsers)
+        terms = term_counts.keys()
+        for (base, reader, result_cache), postlists in zip(segments, segment_postlists):
+            with stage('get_postlists'):
+                segment_terms_postlists = zip(terms, reader.get_postlists(terms))
+            for term, postlist in segment_terms_postlists:
+                postlists[term] = pl_to_array(postlist) if term_counts[term] > 1 else postlist
+        return [reader for base, reader, result_cache in segments], query_parsers
+
+    def _profiled(self, name, func, *args):
+        """
+        returns func(*args), profiled as name if profiling is on
+        """
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.run(name, func, *args)
+
+    def _profiled_parts(self, name, func, *args):
+        """
+        returns iterable parts of func(*args), profiled as name if profiling is on
+        """
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.run_parts(name, func, *args)
+
+    def _iter_answer_pool(self, queries):
+        """
+        generates outputs of search for queries executed by workers of segments:
+        queries are parsed here, and executed in all segments at once (see shards.py)
+        """
+        readers = [reader for base, reader, result_cache in self.segments()]
+        parsed = []
+        for query in queries:
+            parser = Parser(None)
+            try:
+                if query:
+                    self._parse(query, [parser])
+                    parsed.append(parser.parsed_query())
+            except Exception as e:
+                parsed.append(e)
+        with stage('shards'):
+            results = iter(self.pool.execute(
+                [reader.index_path for reader in readers],
+                [query for query in parsed if not isinstance(query, Exception)]
+            ))
+        parsed = iter(parsed)
+        for query in queries:
+            if not query:
+                yield '\n'
+                continue
+            query_parsed = next(parsed)
+            if isinstance(query_parsed, Exception):
+                yield self._parsing_error(query, query_parsed)
+            else:
+                for part in self._output(query, readers, next(results)):
+                    yield part
+
+    def _parse(self, query, parsers):
+        """
+        parse query with parsers of all segments
+        (syntax is checked by one more parser if there are no segments)
+        """
+        with stage('parse'):
+            for parser in parsers or [Parser(None)]:
+                parser.parse(query)
+
+    def _parsing_error(self, query, e):
+        return '{}\nPARSING ERROR: {}\n'.format(query, e)
+
+    def _execute(self, query, readers, parsers):
+        """
+        generates output of search for query parsed by parsers (one for every segment)
+        """
+        results = []
+        for parser in parsers:
+            parser.prepare_postlists()
+            results.append(parser.results(self.stream))
+        return self._output(query, readers, results)
+
+    def _output(self, query, readers, results):
+        """
+        generates output of search for query with docIDs of results in every segment:
+        query and count of results, then urls by chunks of url_chunk_size
+        """
+        for ans in results:
+            assert((np.diff(np.asarray(ans, dtype='int64')) > 0).all())
+        n_results = sum(len(ans) for ans in results)
+        count('results', n_results)
+        yield '{}\n{}\n'.format(query, n_results)
+        if self.count_only:
+            return
+        # slice of results of all segments is resolved segment by segment
+        offset, limit = self.offset, self.limit
+        for reader, ans in zip(readers, results):
+            start = min(offset, len(ans))
+            end = len(ans) if limit is None else min(len(ans), start + limit)
+            offset -= start
+            if limit is not None:
+                limit -= end - start
+            for chunk_start in xrange(start, end, url_chunk_size):
+                with stage('get_urls'):
+                    urls = reader.get_urls(ans[chunk_start:min(chunk_start + url_chunk_size, end)])
+                count('urls', len(urls))
+                yield '\n'.join(urls) + '\n'
+
+class SearchHandler(SocketServer.BaseRequestHandler):
+    """
+    answers queries of one connection one by one
+    """
+
+    def handle(self):
+        while True:
+            query = recv_message(self.request)
+            if query is None:
+                break
+            send_message(self.request, self.server.searcher.answer(query))
+
+class SearchServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, searcher):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, SearchHandler)
+        self.searcher = searcher
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='boolean search daemon, '
+                                     'queries are sent by search.py --socket')
+    parser.add_argument('--socket', type=str, default='search.sock',
+                        action='store', dest='socket',
+                        help='Path of unix domain socket to listen (default: search.sock)')
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='evaluate queries document-at-a-time with posting cursors')
+    parser.add_argument('--segments', type=str, default=None,
+                        action='store', dest='segments',
+                        help='search in segmented index in this directory (see index.py --append) '
+                             'instead of index and doc_ids')
+    parser.add_argument('--workers', action='store_true', dest='workers',
+                        help='execute queries in every segment (shard) of --segments '
+                             'by its own worker process in parallel')
+    add_output_arguments(parser)
+    add_profile_argument(parser)
+    parser.add_argument('--cache-mb', type=int, default=256,
+                        action='store', dest='cache_mb',
+                        help='Memory budget for caches of decoded postlists and query results, '
+                             'MB (default: 256, 0: no caches). Counters of caches are '
+                             'printed to stderr on SIGUSR1 and on exit')
+    return parser.parse_args()
+
+def print_cache_stats(searcher):
+    print('cache stats:', json.dumps(searcher.cache_stats(), sort_keys=True), file=sys.stderr)
+
+if __name__ == '__main__':
+    args = parse_command_line()
+    searcher = Searcher(args.stream, cache_size=args.cache_mb * 2**20,
+                        count_only=args.count_only, offset=args.offset, limit=args.limit,
+                        segments_dir=args.segments, workers=args.workers, profile_path=args.profile)
+    server = SearchServer(args.socket, searcher)
+    # socket is removed on kill as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: print_cache_stats(searcher))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+        print_cache_stats(searcher)
+        if searcher.pool is not None:
+            searcher.pool.close()
@@ -0,0 +1,2 @@
+#!/usr/bin/env bash
+python2.7 search_server.py "$@"
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import errno
+import fcntl
+import json
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from cache import PrefixedCache
+from index_reader import IndexReader, lexicon_path
+from index_writer import merge_indexes
+
+# segmented index (index.py --append) is directory with immutable segments:
+#   manifest; json {"generation": g, "segments": [{"name": ..., "base": ..., "n_docs": ...}, ...]}
+#       (and "merge": false if segments must not be merged, e.g. shards of index.py --shards)
+#       segments are in order of doc_ids: local doc_ids of every segment start from 1
+#       (as in index and docs files written by index.py), and doc_id of document
+#       in whole index is base of its segment + its local doc_id
+#       (base of segment is base + n_docs of previous one).
+#       generation is incremented on every change, new segments are named by it.
+#       manifest is never changed in place: new one is written and renamed over it.
+#   <name>.index, <name>.doc_ids, <name>.lexicon; index, docs and lexicon files of segment
+#       (see index.py, there is no lexicon if segment is written by older index.py)
+#   lock; locked (flock) while manifest is changed
+#   merge.lock; locked by process merging segments (only one at a time)
+# segment files are removed after manifest without them is in place,
+# searchers which opened them before still read them (files are memory-mapped).
+
+manifest_name = 'manifest'
+
+# tiered merge policy: segments of tier k have less than
+# tier_min_docs * merge_factor ** (k + 1) documents (all smaller ones are tier 0),
+# merge_factor adjacent segments of the same tier are merged into one (of next tier)
+merge_factor = 4
+tier_min_docs = 1024
+
+def segment_paths(dir_path, name):
+    """
+    returns (index path, docs path) of segment name
+    """
+    return os.path.join(dir_path, name + '.index'), os.path.join(dir_path, name + '.doc_ids')
+
+def move_segment(index_path, docs_path, new_index_path, new_docs_path):
+    """
+    rename files of segment (and its lexicon if there is one)
+    """
+    if os.path.exists(lexicon_path(index_path)):
+        os.rename(lexicon_path(index_path), lexicon_path(new_index_path))
+    os.rename(index_path, new_index_path)
+    os.rename(docs_path, new_docs_path)
+
+def remove_segment(index_path, docs_path):
+    """
+    remove files of segment (and its lexicon if there is one)
+    """
+    if os.path.exists(lexicon_path(index_path)):
+        os.unlink(lexicon_path(index_path))
+    os.unlink(index_path)
+    os.unlink(docs_path)
+
+def read_manifest(dir_path):
+    """
+    returns manifest of segmented index in dir_path (empty one if there is no manifest yet)
+    """
+    try:
+        with open(os.path.join(dir_path, manifest_name)) as f:
+            return json.load(f)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return {'generation': 0, 'segments': []}
+
+def write_manifest(dir_path, manifest):
+    path = os.path.join(dir_path, manifest_name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + '.tmp', path)
+
+@contextmanager
+def locked(dir_path, name='lock', blocking=True):
+    """
+    context manager holding flock of file name in dir_path,
+    yields False if not blocking and file is locked by other process
+    """
+    with open(os.path.join(dir_path, name), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except IOError as e:
+            if blocking or e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def add_segment(dir_path, index_path, docs_path, n_docs):
+    """
+    add index and docs files (written by index.py, they are moved to dir_path)
+    as new segment after the last one, returns name of segment
+    """
+    with locked(dir_path):
+        manifest = read_manifest(dir_path)
+        manifest['generation'] += 1
+        name = 'seg_{}'.format(manifest['generation'])
+        segments = manifest['segments']
+        base = segments[-1]['base'] + segments[-1]['n_docs'] if segments else 0
+        move_segment(index_path, docs_path, *segment_paths(dir_path, name))
+        segments.append({'name': name, 'base': base, 'n_docs': n_docs})
+        write_manifest(dir_path, manifest)
+    return name
+
+def segment_tier(n_docs):
+    tier = 0
+    while n_docs >= tier_min_docs * merge_factor ** (tier + 1):
+        tier += 1
+    return tier
+
+def find_merge(segments):
+    """
+    returns list of merge_factor adjacent segments of the same tier to merge
+    (the oldest ones), or None if there are no such segments
+    """
+    run = []
+    for segment in segments:
+        if run and segment_tier(segment['n_docs']) != segment_tier(run[0]['n_docs']):
+            run = []
+        run.append(segment)
+        if len(run) == merge_factor:
+            return run
+    return None
+
+def merge_segments(dir_path, segments):
+    """
+    merge adjacent segments into one new segment, which replaces them in manifest
+    (their files are removed then). segments are read as they are,
+    other segments may be added and merged at the same time.
+    """
+    from index import write_docs
+    paths = [segment_paths(dir_path, segment['name']) for segment in segments]
+    tmp_index_path, tmp_docs_path = segment_paths(dir_path, 'merging_{}'.format(os.getpid()))
+    base = segments[0]['base']
+    merge_indexes([index_path for index_path, docs_path in paths], tmp_index_path,
+                  [segment['base'] - base for segment in segments])
+    docs = []
+    for (index_path, docs_path), segment in zip(paths, segments):
+        reader = IndexReader(index_path, docs_path)
+        docs += reader.get_urls(xrange(1, segment['n_docs'] + 1))
+    write_docs(docs, tmp_docs_path)
+    names = [segment['name'] for segment in segments]
+    with locked(dir_path):
+        manifest = read_manifest(dir_path)
+        manifest['generation'] += 1
+        name = 'seg_{}'.format(manifest['generation'])
+        move_segment(tmp_index_path, tmp_docs_path, *segment_paths(dir_path, name))
+        old_names = [segment['name'] for segment in manifest['segments']]
+        start = old_names.index(names[0])
+        assert(old_names[start:start + len(names)] == names)
+        manifest['segments'][start:start + len(names)] = [
+            {'name': name, 'base': base, 'n_docs': len(docs)}
+        ]
+        write_manifest(dir_path, manifest)
+    for index_path, docs_path in paths:
+        remove_segment(index_path, docs_path)
+    return name
+
+def compact(dir_path):
+    """
+    merge segments by tiered merge policy until there is nothing to merge.
+    returns False if segments are merged by other process already
+    """
+    with locked(dir_path, 'merge.lock', blocking=False) as acquired:
+        if not acquired:
+            return False
+        while True:
+            manifest = read_manifest(dir_path)
+            if not manifest.get('merge', True):
+                return True
+            segments = find_merge(manifest['segments'])
+            if segments is None:
+                return True
+            merge_segments(dir_path, segments)
+
+def start_background_compact(dir_path):
+    """
+    run compact() for dir_path in detached process (this script),
+    so new segment is searchable before merging is done
+    """
+    with open(os.devnull, 'r+') as devnull:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), dir_path],
+                         stdin=devnull, stdout=devnull, close_fds=True, preexec_fn=os.setsid)
+
+class SegmentedIndex:
+    """
+    readers of segments of segmented index in dir_path.
+    manifest is read again when it is replaced (see segments()),
+    readers of segments which are still in manifest are reused
+    """
+
+    def __init__(self, dir_path, with_docs=True, postlist_cache=None, result_cache=None):
+        """
+        with_docs: open doc_ids of segments (False if urls are not needed)
+        postlist_cache and result_cache are shared by all segments
+        (keys of every segment are prefixed with its name)
+        """
+        self.dir_path = dir_path
+        self.with_docs = with_docs
+        self.postlist_cache = postlist_cache
+        self.result_cache = result_cache
+        self.manifest_stat = None
+        self.opened = {}
+        self.current = []
+
+    def segments(self):
+        """
+        returns list of (base, IndexReader, result_cache) of current segments in order of doc_ids
+        """
+        path = os.path.join(self.dir_path, manifest_name)
+        for attempt in xrange(3):
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                return []
+            stat = (st.st_ino, st.st_mtime, st.st_size)
+            if stat == self.manifest_stat:
+                return self.current
+            try:
+                self._open(read_manifest(self.dir_path))
+            except (IOError, OSError) as e:
+                # segments were merged (and removed) after manifest was read
+                if e.errno != errno.ENOENT or attempt == 2:
+                    raise
+                continue
+            self.manifest_stat = stat
+            return self.current
+
+    def _open(self, manifest):
+        opened = {}
+        current = []
+        for segment in manifest['segments']:
+            name = segment['name']
+            if name in self.opened:
+                opened[name] = self.opened[name]
+            else:
+                index_path, docs_path = segment_paths(self.dir_path, name)
+                postlist_cache = result_cache = None
+                if self.postlist_cache is not None:
+                    postlist_cache = PrefixedCache(self.postlist_cache, name)
+                    result_cache = PrefixedCache(self.result_cache, name)
+                reader = IndexReader(index_path, docs_path if self.with_docs else None, postlist_cache)
+                opened[name] = (reader, result_cache)
+            current.append((segment['base'],) + opened[name])
+        self.opened = opened
+        self.current = current
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='merge segments of segmented index by tiered '
+                                     'merge policy (run in background by index.py --append)')
+    parser.add_argument('dir', help='Directory of segmented index')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_command_line()
+    compact(args.dir)
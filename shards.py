@@ -0,0 +1,134 @@
+import signal
+import threading
+from collections import defaultdict
+from multiprocessing import Process, Pipe
+from index_reader import IndexReader
+from query_parser import Parser
+from cache import LRUCache
+
+# scatter-gather execution of queries over shards of index (segments of segmented index,
+# see segments.py and index.py --shards): every shard is opened by its own worker process.
+# coordinator (search_server.Searcher) parses query once and sends parsed query
+# (terms and RPN stack, see Parser.parsed_query) to all workers at once,
+# every worker plans and executes it with postlists of its shard
+# and sends back docIDs of results (local to shard, in ascending order),
+# results of shards are in order of doc_ids one after another.
+# messages to worker: list of parsed queries (answered with list of results),
+# 'stats' (answered with counters of caches of worker), None to stop worker.
+
+def shard_worker(conn, index_path, stream, cache_size):
+    """
+    main loop of worker process of shard with index file index_path
+    (see Searcher for stream and cache_size)
+    """
+    # Ctrl-C is handled by coordinator, which stops workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    postlist_cache = result_cache = None
+    if cache_size:
+        postlist_cache = LRUCache(cache_size / 2)
+        result_cache = LRUCache(cache_size / 2)
+    reader = IndexReader(index_path, None, postlist_cache)
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        if msg == 'stats':
+            stats = {}
+            if postlist_cache is not None:
+                stats = {'postlists': postlist_cache.stats(), 'results': result_cache.stats()}
+            conn.send(stats)
+            continue
+        try:
+            results = []
+            for parsed in msg:
+                parser = Parser(reader.get_postlists, result_cache)
+                parser.set_parsed_query(parsed)
+                parser.prepare_postlists()
+                results.append(parser.results(stream))
+        except Exception as e:
+            results = e
+        conn.send(results)
+    conn.close()
+
+class ShardPool:
+    """
+    worker processes of shards, started when shard is executed first time
+    and stopped when shard is not executed any more (e.g. segments were merged).
+    queries are executed by one thread at a time (workers are shared)
+    """
+
+    def __init__(self, stream=False, cache_size=0):
+        """
+        cache_size is memory budget (in bytes) for caches of all workers
+        (divided among workers, see Searcher)
+        """
+        self.stream = stream
+        self.cache_size = cache_size
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def execute(self, index_paths, parsed_queries):
+        """
+        execute parsed queries (see Parser.parsed_query) in shards with index files index_paths
+        returns list of results of every query: list of docIDs of results in every shard
+        """
+        with self.lock:
+            self._start(index_paths)
+            conns = [self.workers[index_path][1] for index_path in index_paths]
+            for conn in conns:
+                conn.send(parsed_queries)
+            shard_results = [conn.recv() for conn in conns]
+        for results in shard_results:
+            if isinstance(results, Exception):
+                raise results
+        return [list(query_results) for query_results in zip(*shard_results)] \
+            if shard_results else [[] for parsed in parsed_queries]
+
+    def cache_stats(self):
+        """
+        returns dict with counters of caches summed over workers (empty if there are no caches),
+        workers which are already terminated are skipped
+        """
+        worker_stats = []
+        with self.lock:
+            for process, conn in self.workers.values():
+                try:
+                    conn.send('stats')
+                    worker_stats.append(conn.recv())
+                except (IOError, EOFError):
+                    pass
+        stats = defaultdict(lambda: defaultdict(int))
+        for worker in worker_stats:
+            for cache, counters in worker.items():
+                for counter, value in counters.items():
+                    stats[cache][counter] += value
+        return dict((cache, dict(counters)) for cache, counters in stats.items())
+
+    def close(self):
+        """
+        stop all workers
+        """
+        with self.lock:
+            self._start([])
+
+    def _start(self, index_paths):
+        """
+        start workers of index_paths which are not started, and stop other workers
+        """
+        for index_path in set(self.workers) - set(index_paths):
+            process, conn = self.workers.pop(index_path)
+            try:
+                conn.send(None)
+            except IOError:
+                # worker is already terminated
+                pass
+            process.join()
+        cache_size = self.cache_size / max(len(index_paths), 1)
+        for index_path in index_paths:
+            if index_path not in self.workers:
+                conn, worker_conn = Pipe()
+                process = Process(target=shard_worker,
+                                  args=(worker_conn, index_path, self.stream, cache_size))
+                process.daemon = True
+                process.start()
+                self.workers[index_path] = (process, conn)